@@ -0,0 +1,500 @@
+"""An in-process stand-in for the ECS and EC2 APIs.
+
+Requests are answered from a ``before-send`` handler, so everything else
+(serialization, response parsing, retries, client-side pacing) runs as it
+would against AWS. Records are generated from their index on demand, which
+keeps clusters of tens of thousands of tasks cheap to set up. Page sizes
+and describe batch limits follow the real APIs.
+"""
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+import boto3
+import botocore.session
+from botocore.awsrequest import AWSResponse
+
+
+REGION = 'us-east-1'
+ACCOUNT = '123456789012'
+ECS_TARGET = 'AmazonEC2ContainerServiceV20141113.'
+EC2_NAMESPACE = 'http://ec2.amazonaws.com/doc/2016-11-15/'
+
+# Default and maximum page sizes of the list calls, and batch limits of
+# the describe calls.
+PAGE_SIZES = {
+    'ListClusters': (100, 100),
+    'ListServices': (10, 100),
+    'ListContainerInstances': (100, 100),
+    'ListTasks': (100, 100),
+    'ListTaskDefinitions': (100, 100),
+    'ListTaskDefinitionFamilies': (100, 100),
+}
+DESCRIBE_LIMITS = {
+    'DescribeClusters': 100,
+    'DescribeServices': 10,
+    'DescribeContainerInstances': 100,
+    'DescribeTasks': 100,
+}
+
+CREATED = datetime(2020, 1, 1)
+
+
+class FakeError(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+
+
+class Raw:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+def epoch(dt):
+    return (dt - datetime(1970, 1, 1)).total_seconds()
+
+
+class FakeAWS:
+    """Generated clusters answering the ECS/EC2 calls ecsctl makes.
+
+    Every cluster has `tasks` tasks, spread round-robin over `services`
+    services and `nodes` container instances. Each service runs its own
+    task definition family with `revisions` revisions. Every request
+    sleeps for `latency` seconds.
+    """
+
+    def __init__(self, clusters=1, tasks=1000, services=100, nodes=50,
+                 revisions=5, latency=0.0):
+        self.cluster_names = ['default'] + [
+            'cluster-%d' % i for i in range(1, clusters)]
+        self.tasks = tasks
+        self.services = services
+        self.nodes = nodes
+        self.revisions = revisions
+        self.latency = latency
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    # -- ARNs and ids --------------------------------------------------
+
+    def arn(self, kind, name):
+        return 'arn:aws:ecs:%s:%s:%s/%s' % (REGION, ACCOUNT, kind, name)
+
+    def cluster_arn(self, cluster):
+        return self.arn('cluster', cluster)
+
+    def task_id(self, cluster, index):
+        return '%08x%024x' % (self.cluster_names.index(cluster), index)
+
+    def task_arn(self, cluster, index):
+        return self.arn('task', '%s/%s' % (cluster,
+                                           self.task_id(cluster, index)))
+
+    def node_arn(self, cluster, index):
+        node_id = '%08x%024x' % (self.cluster_names.index(cluster),
+                                 0xc0000000 + index)
+        return self.arn('container-instance', '%s/%s' % (cluster, node_id))
+
+    def ec2_instance_id(self, cluster, index):
+        return 'i-%04x%013x' % (self.cluster_names.index(cluster), index)
+
+    def service_name(self, index):
+        return 'svc-%d' % index
+
+    def service_arn(self, cluster, index):
+        return self.arn('service', '%s/%s' % (cluster,
+                                              self.service_name(index)))
+
+    def task_definition_arn(self, family, revision):
+        return self.arn('task-definition', '%s:%d' % (family, revision))
+
+    @staticmethod
+    def index_of(arn_or_name):
+        """The index encoded in an id generated above."""
+        name = arn_or_name.rpartition('/')[-1]
+        if name.startswith('svc-'):
+            return int(name[4:])
+        if name.startswith('i-'):
+            return int(name[6:], 16)
+        return int(name[8:], 16) & 0x3fffffff
+
+    def cluster_of(self, params, key='cluster'):
+        name = params.get(key, 'default').rpartition('/')[-1]
+        if name not in self.cluster_names:
+            raise FakeError('ClusterNotFoundException', 'Cluster not found.')
+        return name
+
+    # -- records -------------------------------------------------------
+
+    def cluster(self, cluster):
+        return {
+            'clusterArn': self.cluster_arn(cluster),
+            'clusterName': cluster,
+            'status': 'ACTIVE',
+            'registeredContainerInstancesCount': self.nodes,
+            'runningTasksCount': self.tasks,
+            'pendingTasksCount': 0,
+            'activeServicesCount': self.services,
+            'statistics': [],
+            'tags': [],
+            'settings': [{'name': 'containerInsights', 'value': 'disabled'}],
+            'capacityProviders': [],
+            'defaultCapacityProviderStrategy': [],
+        }
+
+    def service(self, cluster, index):
+        family = self.service_name(index)
+        running = len(range(index, self.tasks, self.services))
+        task_definition = self.task_definition_arn(family, self.revisions)
+        created = CREATED + timedelta(minutes=index)
+        return {
+            'serviceArn': self.service_arn(cluster, index),
+            'serviceName': self.service_name(index),
+            'clusterArn': self.cluster_arn(cluster),
+            'loadBalancers': [],
+            'serviceRegistries': [],
+            'status': 'ACTIVE',
+            'desiredCount': running,
+            'runningCount': running,
+            'pendingCount': 0,
+            'launchType': 'EC2',
+            'taskDefinition': task_definition,
+            'deploymentConfiguration': {
+                'maximumPercent': 200,
+                'minimumHealthyPercent': 100,
+            },
+            'deployments': [{
+                'id': 'ecs-svc/%019d' % index,
+                'status': 'PRIMARY',
+                'taskDefinition': task_definition,
+                'desiredCount': running,
+                'pendingCount': 0,
+                'runningCount': running,
+                'createdAt': epoch(created),
+                'updatedAt': epoch(created),
+                'launchType': 'EC2',
+                'rolloutState': 'COMPLETED',
+            }],
+            'events': [{
+                'id': '%08x-0000-0000-0000-%012x' % (index, index),
+                'createdAt': epoch(created),
+                'message': '(service %s) has reached a steady state.'
+                           % self.service_name(index),
+            }],
+            'createdAt': epoch(created),
+            'placementConstraints': [],
+            'placementStrategy': [{
+                'type': 'spread',
+                'field': 'attribute:ecs.availability-zone',
+            }],
+            'schedulingStrategy': 'REPLICA',
+        }
+
+    def node(self, cluster, index):
+        running = len(range(index, self.tasks, self.nodes))
+
+        def resources(cpu, memory):
+            return [
+                {'name': 'CPU', 'type': 'INTEGER', 'integerValue': cpu},
+                {'name': 'MEMORY', 'type': 'INTEGER', 'integerValue': memory},
+                {'name': 'PORTS', 'type': 'STRINGSET',
+                 'stringSetValue': ['22', '2375', '2376', '51678', '51679']},
+                {'name': 'PORTS_UDP', 'type': 'STRINGSET',
+                 'stringSetValue': []},
+            ]
+        return {
+            'containerInstanceArn': self.node_arn(cluster, index),
+            'ec2InstanceId': self.ec2_instance_id(cluster, index),
+            'version': 1,
+            'versionInfo': {'agentVersion': '1.51.0',
+                            'agentHash': '4023248',
+                            'dockerVersion': 'DockerVersion: 19.03.6-ce'},
+            'remainingResources': resources(max(0, 4096 - 256 * running),
+                                            max(0, 15000 - 512 * running)),
+            'registeredResources': resources(4096, 15000),
+            'status': 'ACTIVE',
+            'agentConnected': True,
+            'runningTasksCount': running,
+            'pendingTasksCount': 0,
+            'attributes': [
+                {'name': 'ecs.availability-zone',
+                 'value': 'us-east-1%s' % 'abc'[index % 3]},
+                {'name': 'ecs.instance-type', 'value': 'm5.xlarge'},
+                {'name': 'ecs.os-type', 'value': 'linux'},
+            ],
+            'registeredAt': epoch(CREATED),
+            'attachments': [],
+            'tags': [],
+        }
+
+    def task(self, cluster, index):
+        service = index % self.services
+        node = index % self.nodes
+        family = self.service_name(service)
+        created = CREATED + timedelta(seconds=index)
+        return {
+            'taskArn': self.task_arn(cluster, index),
+            'clusterArn': self.cluster_arn(cluster),
+            'taskDefinitionArn': self.task_definition_arn(family,
+                                                          self.revisions),
+            'containerInstanceArn': self.node_arn(cluster, node),
+            'overrides': {'containerOverrides': [{'name': 'app'}]},
+            'lastStatus': 'RUNNING',
+            'desiredStatus': 'RUNNING',
+            'cpu': '256',
+            'memory': '512',
+            'containers': [{
+                'containerArn': self.arn('container', '%s/%s' % (
+                    cluster, self.task_id(cluster, index))),
+                'taskArn': self.task_arn(cluster, index),
+                'name': 'app',
+                'image': '%s.dkr.ecr.%s.amazonaws.com/%s:latest'
+                         % (ACCOUNT, REGION, family),
+                'runtimeId': '%064x' % index,
+                'lastStatus': 'RUNNING',
+                'networkBindings': [{'bindIP': '0.0.0.0',
+                                     'containerPort': 8080,
+                                     'hostPort': 32768 + index % 1000,
+                                     'protocol': 'tcp'}],
+                'networkInterfaces': [],
+                'healthStatus': 'UNKNOWN',
+                'cpu': '256',
+                'memory': '512',
+            }],
+            'startedBy': 'ecs-svc/%019d' % service,
+            'version': 2,
+            'connectivity': 'CONNECTED',
+            'connectivityAt': epoch(created),
+            'pullStartedAt': epoch(created),
+            'pullStoppedAt': epoch(created),
+            'createdAt': epoch(created),
+            'startedAt': epoch(created),
+            'group': 'service:%s' % family,
+            'launchType': 'EC2',
+            'attachments': [],
+            'healthStatus': 'UNKNOWN',
+            'tags': [],
+        }
+
+    def task_definition(self, family, revision):
+        return {
+            'taskDefinitionArn': self.task_definition_arn(family, revision),
+            'family': family,
+            'revision': revision,
+            'status': 'ACTIVE',
+            'containerDefinitions': [{
+                'name': 'app',
+                'image': '%s.dkr.ecr.%s.amazonaws.com/%s:latest'
+                         % (ACCOUNT, REGION, family),
+                'cpu': 256,
+                'memory': 512,
+                'portMappings': [{'containerPort': 8080, 'hostPort': 0,
+                                  'protocol': 'tcp'}],
+                'essential': True,
+                'environment': [],
+                'mountPoints': [],
+                'volumesFrom': [],
+            }],
+            'volumes': [],
+            'placementConstraints': [],
+            'compatibilities': ['EC2'],
+            'requiresAttributes': [],
+            'registeredAt': epoch(CREATED + timedelta(days=revision)),
+        }
+
+    # -- API -----------------------------------------------------------
+
+    def page(self, operation, params, items, key, make=None):
+        """One page of `items`, which are mapped through `make` (if
+        given) only once they are on the page."""
+        default_size, max_size = PAGE_SIZES[operation]
+        size = min(params.get('maxResults') or default_size, max_size)
+        start = int(params.get('nextToken') or 0)
+        out = {key: [make(item) if make else item
+                     for item in items[start:start + size]]}
+        if start + size < len(items):
+            out['nextToken'] = str(start + size)
+        return out
+
+    def describe(self, operation, names):
+        if len(names) > DESCRIBE_LIMITS[operation]:
+            raise FakeError('InvalidParameterException',
+                            'Too many items in one %s call.' % operation)
+
+    def ListClusters(self, params):
+        arns = [self.cluster_arn(c) for c in self.cluster_names]
+        return self.page('ListClusters', params, arns, 'clusterArns')
+
+    def DescribeClusters(self, params):
+        names = params.get('clusters') or ['default']
+        self.describe('DescribeClusters', names)
+        clusters = [self.cluster(self.cluster_of({'cluster': name}))
+                    for name in names]
+        return {'clusters': clusters, 'failures': []}
+
+    def ListServices(self, params):
+        cluster = self.cluster_of(params)
+        return self.page('ListServices', params, range(self.services),
+                         'serviceArns',
+                         lambda i: self.service_arn(cluster, i))
+
+    def DescribeServices(self, params):
+        cluster = self.cluster_of(params)
+        self.describe('DescribeServices', params['services'])
+        services = [self.service(cluster, self.index_of(name))
+                    for name in params['services']]
+        return {'services': services, 'failures': []}
+
+    def ListContainerInstances(self, params):
+        cluster = self.cluster_of(params)
+        return self.page('ListContainerInstances', params, range(self.nodes),
+                         'containerInstanceArns',
+                         lambda i: self.node_arn(cluster, i))
+
+    def DescribeContainerInstances(self, params):
+        cluster = self.cluster_of(params)
+        names = params['containerInstances']
+        self.describe('DescribeContainerInstances', names)
+        nodes = [self.node(cluster, self.index_of(name)) for name in names]
+        return {'containerInstances': nodes, 'failures': []}
+
+    def ListTasks(self, params):
+        cluster = self.cluster_of(params)
+        indices = range(self.tasks)
+        if params.get('desiredStatus', 'RUNNING') != 'RUNNING':
+            indices = []
+        if params.get('launchType', 'EC2') != 'EC2':
+            indices = []
+        family = params.get('family') or params.get('serviceName')
+        if family:
+            service = self.index_of(family)
+            indices = indices[service::self.services]
+        if params.get('containerInstance'):
+            node = self.index_of(params['containerInstance'])
+            indices = [i for i in indices if i % self.nodes == node]
+        return self.page('ListTasks', params, indices, 'taskArns',
+                         lambda i: self.task_arn(cluster, i))
+
+    def DescribeTasks(self, params):
+        cluster = self.cluster_of(params)
+        self.describe('DescribeTasks', params['tasks'])
+        tasks = [self.task(cluster, self.index_of(name))
+                 for name in params['tasks']]
+        return {'tasks': tasks, 'failures': []}
+
+    def ListTaskDefinitionFamilies(self, params):
+        prefix = params.get('familyPrefix') or ''
+        families = [self.service_name(i) for i in range(self.services)]
+        families = [f for f in families if f.startswith(prefix)]
+        return self.page('ListTaskDefinitionFamilies', params, families,
+                         'families')
+
+    def ListTaskDefinitions(self, params):
+        prefix = params.get('familyPrefix') or ''
+        arns = [self.task_definition_arn(self.service_name(i), revision)
+                for i in range(self.services)
+                for revision in range(1, self.revisions + 1)
+                if self.service_name(i).startswith(prefix)]
+        if params.get('sort') == 'DESC':
+            arns.reverse()
+        return self.page('ListTaskDefinitions', params, arns,
+                         'taskDefinitionArns')
+
+    def DescribeTaskDefinition(self, params):
+        name = params['taskDefinition'].rpartition('/')[-1]
+        family, _, revision = name.partition(':')
+        revision = int(revision) if revision else self.revisions
+        return {'taskDefinition': self.task_definition(family, revision)}
+
+    def DescribeInstances(self, params):
+        items = []
+        for instance_id in params['InstanceIds']:
+            index = self.index_of(instance_id)
+            items.append(
+                '<item><instanceId>%s</instanceId>'
+                '<instanceState><code>16</code><name>running</name>'
+                '</instanceState>'
+                '<privateDnsName>ip-10-0-%d-%d.ec2.internal</privateDnsName>'
+                '<privateIpAddress>10.0.%d.%d</privateIpAddress>'
+                '<instanceType>m5.xlarge</instanceType></item>'
+                % (instance_id, index // 256, index % 256,
+                   index // 256, index % 256))
+        return (
+            '<DescribeInstancesResponse xmlns="%s">'
+            '<requestId>00000000-0000-0000-0000-000000000000</requestId>'
+            '<reservationSet><item><reservationId>r-0</reservationId>'
+            '<ownerId>%s</ownerId><instancesSet>%s</instancesSet>'
+            '</item></reservationSet></DescribeInstancesResponse>'
+            % (EC2_NAMESPACE, ACCOUNT, ''.join(items)))
+
+    # -- transport -----------------------------------------------------
+
+    def count(self, operation):
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def handle(self, request, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        body = request.body or b''
+        if not isinstance(body, str):
+            body = body.decode('utf-8')
+        target = request.headers.get('X-Amz-Target')
+        if target is not None:
+            if not isinstance(target, str):
+                target = target.decode('utf-8')
+            return self.handle_ecs(request, target[len(ECS_TARGET):], body)
+        return self.handle_ec2(request, body)
+
+    def handle_ecs(self, request, operation, body):
+        self.count(operation)
+        try:
+            payload = getattr(self, operation)(json.loads(body or '{}'))
+            status = 200
+        except FakeError as e:
+            payload = {'__type': e.code, 'message': e.message}
+            status = 400
+        data = json.dumps(payload).encode('utf-8')
+        headers = {
+            'x-amzn-RequestId': '00000000-0000-0000-0000-000000000000',
+            'Content-Type': 'application/x-amz-json-1.1',
+            'Content-Length': str(len(data)),
+        }
+        return AWSResponse(request.url, status, headers, Raw(data))
+
+    def handle_ec2(self, request, body):
+        query = parse_qs(body)
+        operation = query['Action'][0]
+        self.count(operation)
+        params = {'InstanceIds': [
+            value[0] for key, value in sorted(query.items())
+            if key.startswith('InstanceId.')]}
+        data = getattr(self, operation)(params).encode('utf-8')
+        headers = {'Content-Type': 'text/xml;charset=UTF-8',
+                   'Content-Length': str(len(data))}
+        return AWSResponse(request.url, 200, headers, Raw(data))
+
+    def session(self):
+        """A boto3 session whose ECS and EC2 clients talk to this fake."""
+        core = botocore.session.Session()
+        core.set_config_variable('region', REGION)
+        core.set_credentials('AKIDBENCHMARK', 'benchmark')
+        # Registered last so that client-side pacing still runs first.
+        events = core.get_component('event_emitter')
+        events.register_last('before-send.ecs', self.handle)
+        events.register_last('before-send.ec2', self.handle)
+        return boto3.session.Session(botocore_session=core)
@@ -0,0 +1,186 @@
+"""Time ecsctl commands against a generated cluster, without AWS.
+
+Every case runs in its own process so that peak RSS can be measured per
+case. Run from the repository root::
+
+    python -m benchmarks.run --tasks 50000 --services 2000 --nodes 1000
+    python -m benchmarks.run --latency 0.05 get-task exec-service
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+
+CASES = [
+    ('startup', None),
+    ('get-cluster', ['get', 'cluster']),
+    ('get-service', ['get', 'service']),
+    ('get-service-all-clusters', ['get', 'service', '--all-clusters']),
+    ('get-container-instance', ['get', 'container-instance']),
+    ('get-task', ['get', 'task']),
+    ('get-task-wide', ['get', 'task', '-o', 'wide']),
+    ('get-task-json', ['get', 'task', '-o', 'json']),
+    ('get-task-sorted', ['get', 'task', '--sort-by', 'createdAt']),
+    ('get-task-all-clusters', ['get', 'task', '--all-clusters']),
+    ('get-task-service', ['get', 'task', '--service', 'svc-0']),
+    ('get-task-definition', ['get', 'task-definition']),
+    ('get-task-definition-family', ['get', 'task-definition-family']),
+    ('exec-service', None),
+    ('exec-cluster', None),
+]
+CASE_NAMES = [name for name, _ in CASES]
+
+
+def fake_options(options):
+    return dict(clusters=options['clusters'], tasks=options['tasks'],
+                services=options['services'], nodes=options['nodes'],
+                revisions=options['revisions'],
+                latency=options['latency'])
+
+
+def run_command(fake, args, options):
+    from ecsctl.cmds import cli
+    from ecsctl.config import default_config
+    obj = dict(default_config)
+    obj.update(session=fake.session(),
+               concurrency=str(options['concurrency']),
+               rate_limit=str(options['rate_limit']))
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = time.time()
+        cli.main(args, obj=obj, prog_name='ecsctl', standalone_mode=False)
+        return time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def run_exec_resolution(fake, service, options):
+    """What `exec --service` does before it connects to any docker host."""
+    from ecsctl import wrapboto
+    from ecsctl.cache import DiskCache
+    from ecsctl.config import CACHE_FILE
+    from ecsctl.pty import FanOutExec
+    from ecsctl.ratelimit import RateLimiter
+    bw = wrapboto.BotoWrapper(
+        session=fake.session(),
+        concurrency=options['concurrency'],
+        cache=DiskCache(CACHE_FILE),
+        rate_limiter=RateLimiter(options['rate_limit']),
+    )
+    start = time.time()
+    tasks = bw.get_tasks(cluster='default', service=service)
+    FanOutExec(bw=bw, tasks=tasks, command=['true'], api_version='1.24',
+               concurrency=options['concurrency']).resolve_hosts()
+    return time.time() - start
+
+
+def run_worker(case, options):
+    from benchmarks.fake_aws import FakeAWS
+    fake = FakeAWS(**fake_options(options))
+    if case == 'exec-service':
+        wall = run_exec_resolution(fake, 'svc-0', options)
+    elif case == 'exec-cluster':
+        wall = run_exec_resolution(fake, None, options)
+    else:
+        wall = run_command(fake, dict(CASES)[case], options)
+    return {'wall': wall, 'calls': fake.calls}
+
+
+def spawn(args, env):
+    """Run a process; return its wall time, output and peak RSS in MB."""
+    start = time.time()
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, env=env)
+    output = proc.stdout.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.time() - start
+    if status != 0:
+        raise click.ClickException('%s failed.' % ' '.join(args))
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return wall, output, usage.ru_maxrss / float(scale)
+
+
+def run_case(case, options, env):
+    if case == 'startup':
+        wall, _, rss = spawn([sys.executable, '-m', 'ecsctl', '--help'], env)
+        return {'case': case, 'wall': wall, 'calls': 0, 'rss_mb': rss,
+                'operations': {}}
+    args = [sys.executable, '-m', 'benchmarks.run', '--worker', case,
+            '--options', json.dumps(options)]
+    _, output, rss = spawn(args, env)
+    result = json.loads(output.decode('utf-8'))
+    return {'case': case, 'wall': result['wall'],
+            'calls': sum(result['calls'].values()), 'rss_mb': rss,
+            'operations': result['calls']}
+
+
+@click.command()
+@click.option('--clusters', default=1, show_default=True)
+@click.option('--tasks', default=10000, show_default=True,
+              help='Tasks per cluster.')
+@click.option('--services', default=1000, show_default=True,
+              help='Services per cluster.')
+@click.option('--nodes', default=500, show_default=True,
+              help='Container instances per cluster.')
+@click.option('--revisions', default=5, show_default=True,
+              help='Task definition revisions per service.')
+@click.option('--latency', default=0.02, show_default=True,
+              help='Seconds every API call takes.')
+@click.option('--concurrency', default=8, show_default=True)
+@click.option('--rate-limit', default=1000.0, show_default=True,
+              help='Client-side calls per second per API; the default is '
+                   'high enough not to pace the fake.')
+@click.option('--repeat', default=1, show_default=True,
+              help='Runs per case; the fastest one is reported.')
+@click.option('--json', 'as_json', is_flag=True, default=False,
+              help='Print the results as JSON.')
+@click.option('--worker', hidden=True)
+@click.option('--options', hidden=True)
+@click.argument('cases', nargs=-1, type=click.Choice(CASE_NAMES))
+def main(clusters, tasks, services, nodes, revisions, latency, concurrency,
+         rate_limit, repeat, as_json, worker, options, cases):
+    if worker:
+        result = run_worker(worker, json.loads(options))
+        click.echo(json.dumps(result))
+        return
+    options = dict(clusters=clusters, tasks=tasks, services=services,
+                   nodes=nodes, revisions=revisions, latency=latency,
+                   concurrency=concurrency, rate_limit=rate_limit)
+    # A fresh home directory per run keeps the config and the cache of
+    # the user out of the measurements; every case starts with a cold
+    # cache.
+    home = tempfile.mkdtemp(prefix='ecsctl-bench-')
+    env = dict(os.environ, HOME=home, XDG_CONFIG_HOME=home)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.getcwd()] + [p for p in [env.get('PYTHONPATH')] if p])
+    results = []
+    try:
+        for case in cases or CASE_NAMES:
+            runs = []
+            for _ in range(repeat):
+                shutil.rmtree(home)
+                os.makedirs(home)
+                runs.append(run_case(case, options, env))
+            best = min(runs, key=lambda r: r['wall'])
+            best['rss_mb'] = max(r['rss_mb'] for r in runs)
+            results.append(best)
+            if not as_json:
+                click.echo('%-28s %8.3fs %7d calls %8.1f MB' % (
+                    case, best['wall'], best['calls'], best['rss_mb']))
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+    if as_json:
+        click.echo(json.dumps({'options': options, 'results': results},
+                              indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
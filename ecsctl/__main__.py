@@ -1,3 +1,5 @@
+# Imported first so that --timings can account for startup.
+from . import timings  # noqa: F401
 from .cmds import cli
 from .config import default_config
 
@@ -0,0 +1,135 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+'''
+
+
+def _encode_default(obj):
+    if isinstance(obj, datetime):
+        return {'__datetime__': obj.isoformat()}
+    raise TypeError
+
+
+def _decode_hook(obj):
+    if len(obj) == 1 and '__datetime__' in obj:
+        from dateutil.parser import parse as parse_datetime
+        return parse_datetime(obj['__datetime__'])
+    return obj
+
+
+def encode(value):
+    data = json.dumps(value, default=_encode_default, separators=(',', ':'))
+    return zlib.compress(data.encode('utf-8'))
+
+
+def decode(blob):
+    data = zlib.decompress(bytes(blob)).decode('utf-8')
+    return json.loads(data, object_hook=_decode_hook)
+
+
+class DiskCache:
+    """A small key/value store in a sqlite file.
+
+    Values are stored as zlib-compressed JSON (datetimes survive the round
+    trip). Once the compressed size of all entries exceeds `max_bytes`,
+    the least recently used entries are evicted. The database is only
+    opened on first use.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            conn = sqlite3.connect(self.path, timeout=10,
+                                   check_same_thread=False)
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def get(self, key, max_age=None):
+        """Return the value stored under `key`, or None.
+
+        With `max_age` (seconds), entries stored longer ago than that are
+        treated as missing.
+        """
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT value, created FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if max_age is not None and now - row[1] > max_age:
+                return None
+            with self.conn:
+                self.conn.execute(
+                    'UPDATE entries SET accessed = ? WHERE key = ?',
+                    (now, key),
+                )
+        return decode(row[0])
+
+    def put(self, key, value):
+        blob = encode(value)
+        now = time.time()
+        with self._lock:
+            with self.conn:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO entries '
+                    '(key, value, size, created, accessed) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key, sqlite3.Binary(blob), len(blob), now, now),
+                )
+                self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            with self.conn:
+                self.conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._lock:
+            with self.conn:
+                self.conn.execute('DELETE FROM entries')
+
+    def _evict(self):
+        total, = self.conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries'
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        victims = []
+        rows = self.conn.execute(
+            'SELECT key, size FROM entries ORDER BY accessed'
+        )
+        for key, size in rows:
+            if excess <= 0:
+                break
+            victims.append((key,))
+            excess -= size
+        self.conn.executemany('DELETE FROM entries WHERE key = ?', victims)
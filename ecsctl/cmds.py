@@ -1,27 +1,141 @@
 
+import collections
+import itertools
 import click
 from .alias import AliasedGroup
 from . import wrapboto
-from .config import read_config, update_config, default_config
+from .cache import DiskCache
+from .config import read_config, update_config, default_config, CACHE_FILE
+from .config import INDEX_FILE
+from .index import TaskDefinitionIndex, parse_task_definition_arn
 from . import display
-from .pty import Pty
-import tabulate
+from .ratelimit import RateLimiter, parse_rates
+from .timings import Timings
+from .selector import (SelectorError, Selector, Template,
+                       parse_custom_columns, parse_field_selector,
+                       format_values)
 import datetime
-import pytz
-import humanize
-from jsonpath import jsonpath as jp
+import time
 
 
 TASK_DEFINITION_STATUS = ['ACTIVE', 'INACTIVE', 'ALL']
+TASK_DESIRED_STATUS = ['RUNNING', 'PENDING', 'STOPPED']
+LAUNCH_TYPES = ['EC2', 'FARGATE', 'EXTERNAL']
+
+
+def selector_callback(parse):
+    def callback(ctx, param, value):
+        if value is None:
+            return None
+        try:
+            return parse(value)
+        except SelectorError as e:
+            raise click.BadParameter(str(e))
+    return callback
+
+
+OUTPUT_FORMATS = ['json', 'jsonl', 'wide']
+
+
+def parse_output(value):
+    if value in OUTPUT_FORMATS:
+        return value, None
+    kind, _, arg = value.partition('=')
+    if kind == 'custom-columns' and arg:
+        return kind, parse_custom_columns(arg)
+    if kind == 'jsonpath' and arg:
+        return kind, Template(arg)
+    raise SelectorError('Unknown output format %r, expected one of %s, '
+                        'custom-columns=... or jsonpath=...'
+                        % (value, ', '.join(OUTPUT_FORMATS)))
+
+
+def is_wide(output):
+    return output is not None and output[0] == 'wide'
+
+
+sort_by_option = click.option(
+    '--sort-by', callback=selector_callback(Selector),
+    help='Sort by the value at this path, e.g. "createdAt".')
+field_selector_option = click.option(
+    '--field-selector', callback=selector_callback(parse_field_selector),
+    help='Only show records matching path=value[,path!=value...].')
+output_option = click.option(
+    '-o', '--output', callback=selector_callback(parse_output),
+    help=('json, jsonl, wide, custom-columns=NAME:.path[,...] '
+          'or jsonpath=TEMPLATE.'))
+stream_option = click.option(
+    '--stream', is_flag=True, default=False,
+    help='Print rows as they are fetched.')
 
 
 @click.group()
+@click.option('--concurrency', type=click.IntRange(min=1),
+              help='Number of describe calls to send in parallel.')
+@click.option('--no-cache', is_flag=True, default=False,
+              help='Do not read or write the local cache.')
+@click.option('--timings', is_flag=True, default=False,
+              envvar='ECSCTL_TIMINGS',
+              help='Print the latency of every API call on exit.')
+@click.option('--timings-format', type=click.Choice(['text', 'json']),
+              default='text', envvar='ECSCTL_TIMINGS_FORMAT',
+              help='Format of the --timings report.')
 @click.pass_context
-def cli(ctx):
+def cli(ctx, concurrency, no_cache, timings, timings_format):
+    if 'bw' in ctx.obj:
+        # A command run from `ecsctl shell` shares the session's wrapper.
+        return
     for k, v in read_config().items():
         if k in ctx.obj:
             ctx.obj[k] = v
-    ctx.obj['bw'] = wrapboto.BotoWrapper()
+    if not concurrency:
+        concurrency = int(ctx.obj['concurrency'])
+    cache = None
+    index_ttl = float(ctx.obj['index_ttl'])
+    index = TaskDefinitionIndex(':memory:', ttl=index_ttl)
+    if not no_cache:
+        max_bytes = int(ctx.obj['cache_size_mb']) * 1024 * 1024
+        cache = DiskCache(CACHE_FILE, max_bytes=max_bytes)
+        index = TaskDefinitionIndex(INDEX_FILE, ttl=index_ttl)
+    try:
+        rates = parse_rates(ctx.obj['rate_limits'])
+    except ValueError as e:
+        raise click.ClickException('Invalid rate_limits config: %s' % e)
+    rate_limiter = RateLimiter(float(ctx.obj['rate_limit']), rates)
+    recorder = None
+    if timings:
+        recorder = Timings()
+        recorder.activate()
+        ctx.call_on_close(lambda: click.echo(
+            recorder.report(timings_format), err=True))
+    response_cache = None
+    if ctx.invoked_subcommand == 'shell':
+        from .shell import ResponseCache
+        response_cache = ResponseCache()
+    # A boto3 session can be passed in ctx.obj (used by the benchmarks).
+    ctx.obj['bw'] = wrapboto.BotoWrapper(session=ctx.obj.get('session'),
+                                         concurrency=concurrency,
+                                         cache=cache,
+                                         rate_limiter=rate_limiter,
+                                         timings=recorder,
+                                         index=index,
+                                         response_cache=response_cache)
+
+
+@cli.command(short_help='Run commands in an interactive session.')
+@click.pass_context
+def shell(ctx):
+    """Read ecsctl commands (without the leading `ecsctl`) from the
+    terminal and run them with the same AWS clients.
+
+    Startup, credentials and connections are paid for once. API
+    responses are reused by later commands for a few seconds (longer
+    for rarely changing resources like clusters); `refresh` forgets
+    them, and so does any command that changes something. Global
+    options such as --no-cache apply to the whole session.
+    """
+    from .shell import run_shell
+    run_shell(cli, ctx.obj)
 
 
 @cli.group(short_help='Manage config file.')
@@ -170,28 +284,156 @@ def describe_cluster(ctx, cluster):
     click.echo(output)
 
 
-@cli.command(short_help='Drain node in preparation for maintainence.')
+def parse_attributes(ctx, param, value):
+    attributes = []
+    for attribute in value:
+        name, sep, attr_value = attribute.partition('=')
+        if not name:
+            raise click.BadParameter('Expected NAME or NAME=VALUE.')
+        attributes.append((name, attr_value if sep else None))
+    return attributes
+
+
+attribute_option = click.option(
+    '--attribute', 'attributes', multiple=True, callback=parse_attributes,
+    help=('Select nodes with this attribute (NAME or NAME=VALUE, '
+          'e.g. ecs.ami-id=ami-123). Can be repeated.'))
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60,
+                  'w': 7 * 24 * 60 * 60}
+
+
+def parse_duration(ctx, param, value):
+    """Turn a duration such as 90s, 15m, 12h, 30d or 2w into seconds."""
+    if value is None:
+        return None
+    number, unit = value[:-1], value[-1:]
+    if unit not in DURATION_UNITS or not number.isdigit():
+        raise click.BadParameter('Expected a number followed by one of %s, '
+                                 'e.g. 30d.' % ', '.join(DURATION_UNITS))
+    return int(number) * DURATION_UNITS[unit]
+
+
+filter_option = click.option(
+    '--filter', 'query',
+    help='Select nodes matching this cluster query language expression.')
+
+
+def select_nodes(bw, cluster, nodes, attributes, query):
+    """Return the container instances to act on, without duplicates.
+
+    `nodes` are container instance IDs or ARNs, or EC2 instance IDs.
+    EC2 instance IDs, attributes and the query are all resolved with
+    server-side filters of list_container_instances.
+    """
+    selected = [n for n in nodes if not n.startswith('i-')]
+    instance_ids = [n for n in nodes if n.startswith('i-')]
+    for batch in wrapboto.chunked(instance_ids, 20):
+        expr = 'ec2InstanceId in [%s]' % ', '.join(
+            "'%s'" % i for i in batch)
+        selected.extend(bw.all_container_instance_arns(cluster, query=expr))
+    terms = []
+    for name, value in attributes:
+        if value is None:
+            terms.append('attribute:%s exists' % name)
+        else:
+            terms.append('attribute:%s == %s' % (name, value))
+    if query:
+        terms.append('(%s)' % query)
+    if terms:
+        expr = ' and '.join(terms)
+        selected.extend(bw.all_container_instance_arns(cluster, query=expr))
+    if not selected:
+        raise click.ClickException('No matching container instances.')
+    seen = set()
+    return [n for n in selected if not (n in seen or seen.add(n))]
+
+
+def echo_state_change(updated, failures):
+    for r in updated:
+        click.echo(r['containerInstanceArn'])
+    for failure in failures:
+        click.echo('%s: %s' % (failure.get('arn'), failure.get('reason')),
+                   err=True)
+
+
+def wait_for_drain(bw, nodes, cluster, interval, timeout):
+    """Poll the nodes until no task runs on any of them.
+
+    Nodes are described in batches of 100, and only the ones that still
+    have tasks are polled again. Progress is printed to stderr whenever
+    it changes. Returns False if `timeout` (seconds) runs out first.
+    """
+    total = len(nodes)
+    started = time.time()
+    progress = None
+    while True:
+        busy = [r for r in bw.describe_container_instances(nodes, cluster)
+                if r['runningTasksCount'] or r['pendingTasksCount']]
+        nodes = [r['containerInstanceArn'] for r in busy]
+        tasks = sum(r['runningTasksCount'] + r['pendingTasksCount']
+                    for r in busy)
+        if (len(nodes), tasks) != progress:
+            progress = (len(nodes), tasks)
+            click.echo('%d/%d nodes drained, %d tasks left'
+                       % (total - len(nodes), total, tasks), err=True)
+        if not nodes:
+            return True
+        if timeout is not None and time.time() - started >= timeout:
+            return False
+        time.sleep(interval)
+
+
+@cli.command(short_help='Drain nodes in preparation for maintainence.')
 @click.option('--cluster')
-@click.argument('node', required=True)
+@attribute_option
+@filter_option
+@click.option('--wait', is_flag=True, default=False,
+              help='Wait until no tasks are left on the nodes.')
+@click.option('--interval', type=float, default=10.0, show_default=True,
+              help='Seconds between polls with --wait.')
+@click.option('--timeout', type=float,
+              help='Give up waiting after this many seconds.')
+@click.argument('nodes', nargs=-1)
 @click.pass_context
-def drain(ctx, node, cluster):
+def drain(ctx, nodes, cluster, attributes, query, wait, interval, timeout):
+    """Drain NODES and the nodes matching --attribute and --filter.
+
+    NODES are container instance IDs or ARNs, or EC2 instance IDs.
+    """
     if not cluster:
         cluster = ctx.obj['cluster']
     bw = ctx.obj['bw']
-    resp = bw.drain_node(node, cluster=cluster)
-    click.echo(resp['containerInstances'][0]['containerInstanceArn'])
+    nodes = select_nodes(bw, cluster, nodes, attributes, query)
+    updated, failures = bw.drain_nodes(nodes, cluster=cluster)
+    echo_state_change(updated, failures)
+    if wait and updated:
+        arns = [r['containerInstanceArn'] for r in updated]
+        if not wait_for_drain(bw, arns, cluster, interval, timeout):
+            raise click.ClickException('Timed out waiting for the nodes '
+                                       'to drain.')
+    if failures:
+        ctx.exit(1)
 
 
-@cli.command(short_help='Undrain node back into active status.')
+@cli.command(short_help='Undrain nodes back into active status.')
 @click.option('--cluster')
-@click.argument('node', required=True)
+@attribute_option
+@filter_option
+@click.argument('nodes', nargs=-1)
 @click.pass_context
-def undrain(ctx, node, cluster):
+def undrain(ctx, nodes, cluster, attributes, query):
+    """Undrain NODES and the nodes matching --attribute and --filter.
+
+    NODES are container instance IDs or ARNs, or EC2 instance IDs.
+    """
     if not cluster:
         cluster = ctx.obj['cluster']
     bw = ctx.obj['bw']
-    resp = bw.undrain_node(node, cluster=cluster)
-    click.echo(resp['containerInstances'][0]['containerInstanceArn'])
+    nodes = select_nodes(bw, cluster, nodes, attributes, query)
+    updated, failures = bw.undrain_nodes(nodes, cluster=cluster)
+    echo_state_change(updated, failures)
+    if failures:
+        ctx.exit(1)
 
 
 @cli.command(name='exec', short_help='Execute a command in a container.')
@@ -201,11 +443,23 @@ def undrain(ctx, node, cluster):
 @click.option('--container', default=None)
 @click.option('--docker-port', type=int)
 @click.option('--docker-api-version')
-@click.argument('task', required=True)
-@click.argument('command', nargs=-1)
+@click.option('--service', help='Run in every task of this service.')
+@click.option('--family',
+              help='Run in every task of this task definition family.')
+@click.option('--field-selector',
+              callback=selector_callback(parse_field_selector),
+              help='Run in every task matching path=value[,...].')
+@click.argument('args', nargs=-1, required=True, metavar='[TASK] COMMAND...')
 @click.pass_context
-def exec_command(ctx, task, command, stdin, tty, cluster, docker_port,
-                 docker_api_version, container):
+def exec_command(ctx, args, stdin, tty, cluster, docker_port,
+                 docker_api_version, container, service, family,
+                 field_selector):
+    """Execute COMMAND in the container of TASK.
+
+    With --service, --family or --field-selector, TASK is left out and
+    COMMAND runs non-interactively in every matching task at once; each
+    output line is prefixed with the task ID.
+    """
     if not cluster:
         cluster = ctx.obj['cluster']
     if not docker_port:
@@ -213,6 +467,18 @@ def exec_command(ctx, task, command, stdin, tty, cluster, docker_port,
     if not docker_api_version:
         docker_api_version = ctx.obj['docker_api_version']
     bw = ctx.obj['bw']
+    if service or family or field_selector:
+        if stdin or tty:
+            raise click.UsageError(
+                '-i/-t cannot be used when running in many tasks.')
+        exec_fan_out(ctx, bw, args, cluster, docker_port,
+                     docker_api_version, container, service, family,
+                     field_selector)
+        return
+    if len(args) < 2:
+        raise click.UsageError('Missing TASK or COMMAND.')
+    task, command = args[0], args[1:]
+    from .pty import Pty
     pty = Pty(bw=bw, task=task, command=command, cluster=cluster,
               tty=tty, stdin=stdin, port=docker_port,
               api_version=docker_api_version,
@@ -220,170 +486,1097 @@ def exec_command(ctx, task, command, stdin, tty, cluster, docker_port,
     pty.exec_command()
 
 
+def exec_fan_out(ctx, bw, command, cluster, docker_port, docker_api_version,
+                 container, service, family, field_selector):
+    from .pty import FanOutExec
+    tasks = bw.get_tasks(cluster=cluster, service=service, family=family)
+    if field_selector:
+        tasks = (t for t in tasks if field_selector(t))
+    fan_out = FanOutExec(bw=bw, tasks=tasks, command=command,
+                         port=docker_port, cluster=cluster,
+                         api_version=docker_api_version,
+                         container=container, concurrency=bw.concurrency)
+    if not fan_out.tasks:
+        raise click.ClickException('No matching tasks.')
+
+    def emit(task_id, line):
+        click.echo('[%s] %s' % (task_id, line))
+    results = fan_out.run(emit)
+    failed = 0
+    for task_arn, code, error in results:
+        if code == 0:
+            continue
+        failed += 1
+        task_id = task_arn.rpartition('/')[-1]
+        if error is not None:
+            click.echo('%s: error: %s' % (task_id, error), err=True)
+        else:
+            click.echo('%s: exit code %s' % (task_id, code), err=True)
+    click.echo('%d succeeded, %d failed.' % (len(results) - failed, failed),
+               err=True)
+    if failed:
+        ctx.exit(1)
+
+
+@cli.command(short_help='Print the logs of a container.')
+@click.option('--cluster')
+@click.option('--container', default=None,
+              help='Container to read (default: the first one).')
+@click.option('--docker-port', type=int)
+@click.option('--docker-api-version')
+@click.option('--service', help='Print the logs of every task of this '
+                                'service, merged by time.')
+@click.option('-f', '--follow', is_flag=True, default=False,
+              help='Keep printing new lines as they are logged.')
+@click.option('--since', callback=parse_duration,
+              help='Only lines of this last period, e.g. 10m.')
+@click.option('--tail', type=click.IntRange(min=0),
+              help='Only the last N lines of every task.')
+@click.option('--timestamps', is_flag=True, default=False,
+              help='Print the timestamp of every line.')
+@click.argument('task', required=False)
+@click.pass_context
+def logs(ctx, task, cluster, container, docker_port, docker_api_version,
+         service, follow, since, tail, timestamps):
+    """Print the logs of TASK, or of every task of --service.
+
+    Logs are read from the docker daemon of the container instances (see
+    exec), one client per host. Lines of many tasks are merged by their
+    timestamps and prefixed with the task ID.
+    """
+    if bool(task) == bool(service):
+        raise click.UsageError('Give either TASK or --service.')
+    if not cluster:
+        cluster = ctx.obj['cluster']
+    if not docker_port:
+        docker_port = int(ctx.obj['docker_port'])
+    if not docker_api_version:
+        docker_api_version = ctx.obj['docker_api_version']
+    bw = ctx.obj['bw']
+    if task:
+        tasks = [bw.describe_task(task, cluster=cluster)]
+    else:
+        tasks = list(bw.get_tasks(cluster=cluster, service=service))
+    if not tasks:
+        raise click.ClickException('No matching tasks.')
+    from .pty import FanOutLogs
+    fan_out = FanOutLogs(bw=bw, tasks=tasks, port=docker_port,
+                         cluster=cluster, api_version=docker_api_version,
+                         container=container, concurrency=bw.concurrency,
+                         follow=follow,
+                         since=int(time.time() - since) if since else None,
+                         tail='all' if tail is None else tail)
+    if follow and len(tasks) > bw.concurrency:
+        click.echo('Following %d of %d tasks at once, raise --concurrency '
+                   'to follow them all.' % (bw.concurrency, len(tasks)),
+                   err=True)
+    try:
+        for timestamp, task_id, text in fan_out.lines():
+            if timestamps:
+                text = '%s %s' % (timestamp, text)
+            if len(tasks) > 1:
+                text = '[%s] %s' % (task_id, text)
+            click.echo(text)
+    except KeyboardInterrupt:
+        pass
+    for task_arn, error in fan_out.errors:
+        click.echo('%s: error: %s' % (task_arn.rpartition('/')[-1], error),
+                   err=True)
+    if fan_out.errors:
+        ctx.exit(1)
+
+
 @cli.group(cls=AliasedGroup, short_help='Display one or many resources.')
 def get():
     pass
 
 
+def echo_table(rows, headers, stream=False):
+    if stream:
+        for line in display.stream_table(rows, headers):
+            click.echo(line)
+    else:
+        import tabulate
+        output = tabulate.tabulate(list(rows), headers=headers,
+                                   tablefmt='plain')
+        click.echo(output)
+
+
+def check_stream(stream, sort_by):
+    if stream and sort_by:
+        raise click.UsageError('--stream cannot be used with --sort-by.')
+
+
+def check_watch(watch, stream, all_clusters):
+    if watch and stream:
+        raise click.UsageError('--watch cannot be used with --stream.')
+    if watch and all_clusters:
+        raise click.UsageError('--watch cannot be used with --all-clusters.')
+
+
+def custom_columns_table(columns):
+    headers = [name for name, _ in columns]
+
+    def make_row(r):
+        return tuple(format_values(s.all(r)) for _, s in columns)
+    return make_row, headers
+
+
+ProjectedRow = collections.namedtuple('ProjectedRow', ['sort_key', 'value'])
+
+
+def projection(make_row, headers, output=None, sort_by=None,
+               field_selector=None):
+    """Return a function reducing a record to what `output` prints.
+
+    The function maps a record to a ProjectedRow, or to None when the
+    field selector rejects it. Only JSON output keeps the full record;
+    tables keep their cells and jsonpath its rendered line, so records
+    can be dropped as soon as each describe batch is projected, even
+    when every row has to be sorted before printing. Also returns the
+    headers of the table.
+    """
+    kind, arg = output or ('table', None)
+    if kind == 'jsonpath':
+        make_row = arg.render
+    elif kind in ('json', 'jsonl'):
+        def make_row(r):
+            return r
+    elif kind == 'custom-columns':
+        make_row, headers = custom_columns_table(arg)
+
+    def project(r):
+        if field_selector and not field_selector(r):
+            return None
+        sort_key = sort_by.sort_key(r) if sort_by else None
+        return ProjectedRow(sort_key, make_row(r))
+    return project, headers
+
+
+def echo_records(rows, headers, output=None, sort_by=None, stream=False,
+                 all_clusters=False):
+    """Sort and print (cluster name, ProjectedRow) pairs."""
+    if sort_by:
+        rows = sorted(rows, key=lambda cr: cr[1].sort_key)
+    kind, _ = output or ('table', None)
+    if kind == 'jsonpath':
+        for _, row in rows:
+            click.echo(row.value)
+        return
+    if kind in ('json', 'jsonl'):
+        records = (row.value for _, row in rows)
+        if kind == 'json':
+            lines = display.stream_json(records)
+        else:
+            lines = display.stream_json_lines(records)
+        for line in lines:
+            click.echo(line)
+        return
+    rows = cluster_rows(rows, all_clusters)
+    echo_table(rows, cluster_headers(headers, all_clusters), stream=stream)
+
+
+def echo_watch(snapshot, make_row, headers, interval, output=None,
+               sort_by=None, field_selector=None):
+    """Print the whole table, then only the rows that change."""
+    import pytz
+    from .watch import watch
+    kind, arg = output or ('table', None)
+    if kind == 'custom-columns':
+        make_cc_row, headers = custom_columns_table(arg)
+
+        def make_row(r, now):
+            return make_cc_row(r)
+    layout = None
+    try:
+        for records in watch(snapshot, interval):
+            if field_selector:
+                records = [r for r in records if field_selector(r)]
+            if layout is None and sort_by:
+                records.sort(key=sort_by.sort_key)
+            if kind == 'jsonpath':
+                for r in records:
+                    click.echo(arg.render(r))
+                continue
+            if kind in ('json', 'jsonl'):
+                for r in records:
+                    if kind == 'json':
+                        click.echo(display.de_unicode(r))
+                    else:
+                        click.echo(display.json_line(r))
+                continue
+            now = datetime.datetime.now(pytz.utc)
+            rows = [make_row(r, now) for r in records]
+            if layout is None:
+                layout = display.table_layout(rows, headers)
+                click.echo(display.format_row(headers, *layout))
+            for row in rows:
+                click.echo(display.format_row(row, *layout))
+    except KeyboardInterrupt:
+        pass
+
+
+def fetch_records(bw, method, cluster, all_clusters, project, **kwargs):
+    """Yield (cluster name, ProjectedRow) pairs from one or every cluster."""
+    if all_clusters:
+        return bw.across_clusters(method, project=project, **kwargs)
+    projected = ((cluster, project(r)) for r in method(cluster=cluster,
+                                                       **kwargs))
+    return (cr for cr in projected if cr[1] is not None)
+
+
+def cluster_rows(pairs, all_clusters):
+    for cluster, row in pairs:
+        if all_clusters:
+            yield (cluster,) + row.value
+        else:
+            yield row.value
+
+
+def cluster_headers(headers, all_clusters):
+    if all_clusters:
+        return ['CLUSTER'] + headers
+    return headers
+
+
+def cluster_row(r, wide=False):
+    status = r['status']
+    name = r['clusterName']
+    running_count = r['runningTasksCount']
+    pending_count = r['pendingTasksCount']
+    instance_count = r['registeredContainerInstancesCount']
+    row = (name, status, running_count, pending_count, instance_count)
+    if wide:
+        row += (r.get('activeServicesCount', 0),)
+    return row
+
+
+CLUSTER_HEADERS = ['NAME', 'STATUS', 'RUNNING', 'PENDING', 'INSTANCE COUNT']
+CLUSTER_WIDE_HEADERS = CLUSTER_HEADERS + ['SERVICES']
+
+
+def service_row(r, now, wide=False):
+    import humanize
+    service_name = r['serviceName']
+    task_def = display.simple_task_definition(r['taskDefinition'])
+    status = r['status']
+    created_at = r['createdAt']
+    desired_count = r['desiredCount']
+    running_count = r['runningCount']
+    age = humanize.naturaltime(now - created_at)
+    row = (service_name, task_def, desired_count,
+           running_count, status, age)
+    if wide:
+        pending_count = r['pendingCount']
+        launch_type = r.get('launchType', '')
+        deployments = len(r.get('deployments', []))
+        row += (pending_count, launch_type, deployments)
+    return row
+
+
+SERVICE_HEADERS = ['NAME', 'TASK DEFINITION', 'DESIRED', 'RUNNING',
+                   'STATUS', 'AGE']
+SERVICE_WIDE_HEADERS = SERVICE_HEADERS + ['PENDING', 'LAUNCH TYPE',
+                                          'DEPLOYMENTS']
+
+
+def container_instance_row(r, wide=False):
+    status = r['status']
+    ec2_instance_id = r['ec2InstanceId']
+    container_instance_arn = r['containerInstanceArn']
+    instance_id = display.simple_container_instance(container_instance_arn)
+    running_count = r['runningTasksCount']
+    row = (instance_id, ec2_instance_id, status, running_count)
+    if wide:
+        pending_count = r['pendingTasksCount']
+        agent_connected = r['agentConnected']
+        agent_version = r.get('versionInfo', {}).get('agentVersion', '')
+        row += (pending_count, agent_connected, agent_version)
+    return row
+
+
+CONTAINER_INSTANCE_HEADERS = ['INSTANCE ID', 'EC2 INSTANCE ID', 'STATUS',
+                              'RUNNING COUNT']
+CONTAINER_INSTANCE_WIDE_HEADERS = CONTAINER_INSTANCE_HEADERS + [
+    'PENDING COUNT', 'AGENT CONNECTED', 'AGENT VERSION']
+
+
+def task_row(r, now, wide=False):
+    import humanize
+    status = r['lastStatus']
+    created_at = r['createdAt']
+    task_id = display.simple_task(r['taskArn'])
+    task_def = display.simple_task_definition(r['taskDefinitionArn'])
+    age = humanize.naturaltime(now - created_at)
+    row = (task_id, status, task_def, age)
+    if wide:
+        desired_status = r['desiredStatus']
+        group = r.get('group', '')
+        launch_type = r.get('launchType', '')
+        container_instance = display.simple_container_instance(
+            r.get('containerInstanceArn', ''))
+        row += (desired_status, group, launch_type, container_instance)
+    return row
+
+
+TASK_HEADERS = ['TASK ID', 'STATUS', 'TASK DEFINITION', 'AGE']
+TASK_WIDE_HEADERS = TASK_HEADERS + ['DESIRED', 'GROUP', 'LAUNCH TYPE',
+                                    'CONTAINER INSTANCE']
+
+
 @get.command(name='cluster')
-@click.option('--sort-by')
+@sort_by_option
+@field_selector_option
+@output_option
+@stream_option
 @click.pass_context
-def get_clusters(ctx, sort_by):
+def get_clusters(ctx, sort_by, field_selector, output, stream):
+    check_stream(stream, sort_by)
     bw = ctx.obj['bw']
-    records = bw.get_clusters()
-    if sort_by:
-        records.sort(key=lambda r: jp(r, sort_by))
-    out = []
-    for r in records:
-        status = r['status']
-        name = r['clusterName']
-        running_count = r['runningTasksCount']
-        pending_count = r['pendingTasksCount']
-        instance_count = r['registeredContainerInstancesCount']
-        row = (name, status, running_count, pending_count, instance_count)
-        out.append(row)
-    headers = ['NAME', 'STATUS', 'RUNNING', 'PENDING', 'INSTANCE COUNT']
-    output = tabulate.tabulate(out, headers=headers, tablefmt='plain')
-    click.echo(output)
+    wide = is_wide(output)
+    headers = CLUSTER_WIDE_HEADERS if wide else CLUSTER_HEADERS
+    project, headers = projection(lambda r: cluster_row(r, wide), headers,
+                                  output=output, sort_by=sort_by,
+                                  field_selector=field_selector)
+    rows = ((None, project(r)) for r in bw.get_clusters())
+    rows = (cr for cr in rows if cr[1] is not None)
+    echo_records(rows, headers, output=output, sort_by=sort_by,
+                 stream=stream)
 
 
 @get.command(name='service')
 @click.option('--cluster')
-@click.option('--sort-by')
+@click.option('--all-clusters', is_flag=True, default=False,
+              help='List services of every cluster.')
+@sort_by_option
+@field_selector_option
+@output_option
+@stream_option
+@click.option('-w', '--watch', is_flag=True, default=False,
+              help='After listing, keep printing services that change.')
+@click.option('--interval', type=float, default=2.0, show_default=True,
+              help='Seconds between refreshes with --watch.')
 @click.pass_context
-def get_services(ctx, cluster, sort_by):
+def get_services(ctx, cluster, all_clusters, sort_by, field_selector, output,
+                 stream, watch, interval):
+    check_stream(stream, sort_by)
+    check_watch(watch, stream, all_clusters)
     if not cluster:
         cluster = ctx.obj['cluster']
     bw = ctx.obj['bw']
-    records = bw.get_services(cluster=cluster)
-    if sort_by:
-        records.sort(key=lambda r: jp(r, sort_by))
-    out = []
+    wide = is_wide(output)
+    headers = SERVICE_WIDE_HEADERS if wide else SERVICE_HEADERS
+    if watch:
+        from .watch import (Snapshot, service_is_settled,
+                            service_is_terminal)
+        snapshot = Snapshot(
+            lambda: bw.all_service_arns(cluster=cluster),
+            lambda arns: bw.describe_services(arns, cluster=cluster),
+            'serviceArn',
+            service_is_settled,
+            service_is_terminal,
+        )
+        echo_watch(snapshot, lambda r, now: service_row(r, now, wide),
+                   headers, interval,
+                   output=output, sort_by=sort_by,
+                   field_selector=field_selector)
+        return
+    import pytz
     now = datetime.datetime.now(pytz.utc)
-    for r in records:
-        service_name = r['serviceName']
-        task_def = display.simple_task_definition(r['taskDefinition'])
-        status = r['status']
-        created_at = r['createdAt']
-        desired_count = r['desiredCount']
-        running_count = r['runningCount']
-        age = humanize.naturaltime(now - created_at)
-        row = (service_name, task_def, desired_count,
-               running_count, status, age)
-        out.append(row)
-    headers = ['NAME', 'TASK DEFINITION', 'DESIRED', 'RUNNING',
-               'STATUS', 'AGE']
-    output = tabulate.tabulate(out, headers=headers, tablefmt='plain')
-    click.echo(output)
+    project, headers = projection(lambda r: service_row(r, now, wide),
+                                  headers, output=output, sort_by=sort_by,
+                                  field_selector=field_selector)
+    rows = fetch_records(bw, bw.get_services, cluster, all_clusters,
+                         project)
+    echo_records(rows, headers, output=output, sort_by=sort_by,
+                 stream=stream, all_clusters=all_clusters)
 
 
 @get.command(name='container-instance')
 @click.option('--cluster')
-@click.option('--sort-by')
+@click.option('--all-clusters', is_flag=True, default=False,
+              help='List container instances of every cluster.')
+@sort_by_option
+@field_selector_option
+@output_option
+@stream_option
 @click.pass_context
-def get_container_instance(ctx, cluster, sort_by):
+def get_container_instance(ctx, cluster, all_clusters, sort_by,
+                           field_selector, output, stream):
+    check_stream(stream, sort_by)
     if not cluster:
         cluster = ctx.obj['cluster']
     bw = ctx.obj['bw']
-    records = bw.get_container_instances(cluster=cluster)
-    if sort_by:
-        records.sort(key=lambda r: jp(r, sort_by))
-    out = []
-    for r in records:
-        status = r['status']
-        ec2_instance_id = r['ec2InstanceId']
-        container_instance_arn = r['containerInstanceArn']
-        instance_id = display.simple_container_instance(container_instance_arn)
-        running_count = r['runningTasksCount']
-        row = (instance_id, ec2_instance_id, status, running_count)
-        out.append(row)
-    headers = ['INSTANCE ID', 'EC2 INSTANCE ID', 'STATUS', 'RUNNING COUNT']
-    output = tabulate.tabulate(out, headers=headers, tablefmt='plain')
-    click.echo(output)
+    wide = is_wide(output)
+    if wide:
+        headers = CONTAINER_INSTANCE_WIDE_HEADERS
+    else:
+        headers = CONTAINER_INSTANCE_HEADERS
+    project, headers = projection(lambda r: container_instance_row(r, wide),
+                                  headers, output=output, sort_by=sort_by,
+                                  field_selector=field_selector)
+    rows = fetch_records(bw, bw.get_container_instances, cluster,
+                         all_clusters, project)
+    echo_records(rows, headers, output=output, sort_by=sort_by,
+                 stream=stream, all_clusters=all_clusters)
 
 
 @get.command(name='task')
 @click.option('--cluster')
-@click.option('--sort-by')
+@click.option('--all-clusters', is_flag=True, default=False,
+              help='List tasks of every cluster.')
+@sort_by_option
+@field_selector_option
+@output_option
+@stream_option
+@click.option('-w', '--watch', is_flag=True, default=False,
+              help='After listing, keep printing tasks that change.')
+@click.option('--interval', type=float, default=2.0, show_default=True,
+              help='Seconds between refreshes with --watch.')
+@click.option('--service', help='Only tasks started by this service.')
+@click.option('--family', help='Only tasks of this task definition family.')
+@click.option('--node', help='Only tasks on this container instance.')
+@click.option('--desired-status', type=click.Choice(TASK_DESIRED_STATUS),
+              help='Only tasks with this desired status (default RUNNING).')
+@click.option('--launch-type', type=click.Choice(LAUNCH_TYPES),
+              help='Only tasks with this launch type.')
 @click.pass_context
-def get_task(ctx, cluster, sort_by):
+def get_task(ctx, cluster, all_clusters, sort_by, field_selector, output,
+             stream, watch, interval, service, family, node, desired_status,
+             launch_type):
+    check_stream(stream, sort_by)
+    check_watch(watch, stream, all_clusters)
     if not cluster:
         cluster = ctx.obj['cluster']
     bw = ctx.obj['bw']
-    records = bw.get_tasks(cluster=cluster)
-    if sort_by:
-        records.sort(key=lambda r: jp(r, sort_by))
-    out = []
+    filters = dict(service=service, family=family, node=node,
+                   desired_status=desired_status, launch_type=launch_type)
+    wide = is_wide(output)
+    headers = TASK_WIDE_HEADERS if wide else TASK_HEADERS
+    if watch:
+        from .watch import Snapshot, task_is_settled, task_is_terminal
+        snapshot = Snapshot(
+            lambda: bw.all_tasks(cluster=cluster, **filters),
+            lambda arns: bw.describe_tasks(arns, cluster=cluster),
+            'taskArn',
+            task_is_settled,
+            task_is_terminal,
+        )
+        echo_watch(snapshot, lambda r, now: task_row(r, now, wide),
+                   headers, interval,
+                   output=output, sort_by=sort_by,
+                   field_selector=field_selector)
+        return
+    import pytz
     now = datetime.datetime.now(pytz.utc)
-    for r in records:
-        status = r['lastStatus']
-        created_at = r['createdAt']
-        task_id = display.simple_task(r['taskArn'])
-        task_def = display.simple_task_definition(r['taskDefinitionArn'])
-        age = humanize.naturaltime(now - created_at)
-        row = (task_id, status, task_def, age)
-        out.append(row)
-    headers = ['TASK ID', 'STATUS', 'TASK DEFINITION', 'AGE']
-    output = tabulate.tabulate(out, headers=headers, tablefmt='plain')
-    click.echo(output)
+    project, headers = projection(lambda r: task_row(r, now, wide),
+                                  headers, output=output, sort_by=sort_by,
+                                  field_selector=field_selector)
+    rows = fetch_records(bw, bw.get_tasks, cluster, all_clusters, project,
+                         **filters)
+    echo_records(rows, headers, output=output, sort_by=sort_by,
+                 stream=stream, all_clusters=all_clusters)
 
 
 @get.command(name='task-definition-family')
 @click.option('--family-prefix', default=None)
 @click.option('--status', type=click.Choice(TASK_DEFINITION_STATUS),
               default='ACTIVE')
+@output_option
 @click.pass_context
-def get_task_definition_family(ctx, status, family_prefix):
+def get_task_definition_family(ctx, status, family_prefix, output):
+    """List task definition families.
+
+    A family is only a name, so with -o it is printed as a {"family":
+    NAME} record and -o wide prints the same table as the default.
+    """
     bw = ctx.obj['bw']
     records = bw.all_task_definition_families(
         family_prefix=family_prefix,
         status=status,
     )
-    for r in records:
-        click.echo(r)
+    if output is None:
+        for r in records:
+            click.echo(r)
+        return
+    project, headers = projection(lambda r: (r['family'],), ['FAMILY'],
+                                  output=output)
+    rows = ((None, project({'family': r})) for r in records)
+    echo_records(rows, headers, output=output)
+
+
+def task_definition_row(r, wide=False):
+    row = (display.simple_task_definition(r['taskDefinitionArn']),
+           r.get('status'))
+    if wide:
+        row += (r.get('cpu'), r.get('memory'),
+                r.get('networkMode', 'bridge'),
+                len(r.get('containerDefinitions', [])))
+    return row
+
+
+TASK_DEFINITION_HEADERS = ['TASK DEFINITION', 'STATUS']
+TASK_DEFINITION_WIDE_HEADERS = TASK_DEFINITION_HEADERS + [
+    'CPU', 'MEMORY', 'NETWORK MODE', 'CONTAINERS']
 
 
 @get.command(name='task-definition')
 @click.option('--family-prefix', default=None)
+@click.option('--family', default=None,
+              help='Only show revisions of this family.')
 @click.option('--status', type=click.Choice(TASK_DEFINITION_STATUS),
               default='ACTIVE')
+@click.option('--latest', is_flag=True, default=False,
+              help='Only show the latest revision of each family.')
+@click.option('--revisions', type=click.IntRange(min=1),
+              help='Show the latest N revisions of each family.')
+@click.option('--refresh', is_flag=True, default=False,
+              help='Rebuild the local index of ACTIVE revisions.')
+@output_option
 @click.pass_context
-def get_task_definition(ctx, status, family_prefix):
+def get_task_definition(ctx, status, family_prefix, family, latest,
+                        revisions, refresh, output):
+    """List task definition revisions.
+
+    With -o, every revision is described (in parallel, and cached on
+    disk) to print its full record or more columns.
+    """
     bw = ctx.obj['bw']
-    records = bw.all_task_definitions(
-        family_prefix=family_prefix,
-        status=status,
-    )
-    for r in records:
-        out = display.simple_task_definition(r)
-        click.echo(out)
+    if latest and revisions:
+        raise click.UsageError('--latest and --revisions are exclusive.')
+    if latest:
+        revisions = 1
+    if family or revisions or refresh:
+        # Served from the local index, which only holds ACTIVE revisions.
+        if status != 'ACTIVE':
+            raise click.UsageError('--family, --latest, --revisions and '
+                                   '--refresh only apply to ACTIVE '
+                                   'revisions.')
+        records = bw.indexed_task_definitions(
+            family=family,
+            family_prefix=family_prefix,
+            revisions=revisions,
+            full_sync=refresh,
+        )
+    else:
+        records = bw.all_task_definitions(
+            family_prefix=family_prefix,
+            status=status,
+        )
+    if output is None:
+        for r in records:
+            out = display.simple_task_definition(r)
+            click.echo(out)
+        return
+    wide = is_wide(output)
+    headers = (TASK_DEFINITION_WIDE_HEADERS if wide
+               else TASK_DEFINITION_HEADERS)
+    project, headers = projection(lambda r: task_definition_row(r, wide),
+                                  headers, output=output)
+    infos = wrapboto.ordered_map(bw.describe_task_definition, records,
+                                 bw.concurrency)
+    rows = ((None, project(info)) for info in infos)
+    echo_records(rows, headers, output=output)
+
+
+@cli.group(cls=AliasedGroup,
+           short_help='Show CPU, memory and ports reserved by tasks.')
+def top():
+    pass
+
+
+def threshold_option(columns):
+    def callback(ctx, param, value):
+        from .top import parse_thresholds
+        try:
+            return parse_thresholds(value, columns)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+    return click.option(
+        '--threshold', 'thresholds', multiple=True, callback=callback,
+        help=('Only show rows where COLUMN>=N (or >, <=, <, =), e.g. '
+              'cpu>=80; cpu and memory are percentages. Can be repeated.'))
+
+
+def percent(value):
+    if value != value:
+        return '-'
+    return '%d%%' % round(value)
+
+
+def echo_cluster_totals(nodes):
+    """Print reserved and registered resources per cluster to stderr."""
+    totals = nodes.group_by(lambda label: label[0])
+    cpu = totals.ratio('cpu', 'cpu_registered')
+    memory = totals.ratio('memory', 'memory_registered')
+    for i, cluster in enumerate(totals.labels):
+        click.echo('%s: %d nodes, %d tasks, CPU %d/%d (%s), memory %d/%d '
+                   '(%s), %d ports' % (
+                       cluster, totals['count'][i], totals['tasks'][i],
+                       totals['cpu'][i], totals['cpu_registered'][i],
+                       percent(cpu[i]), totals['memory'][i],
+                       totals['memory_registered'][i], percent(memory[i]),
+                       totals['ports'][i]), err=True)
+
+
+def fetch_node_usage(bw, cluster, all_clusters):
+    from .top import Columns, node_usage
+    nodes = Columns(['tasks', 'cpu', 'cpu_registered', 'memory',
+                     'memory_registered', 'ports'])
+    pairs = fetch_records(
+        bw, bw.get_container_instances, cluster, all_clusters,
+        lambda r: ((r['ec2InstanceId'], r['status']), node_usage(r)))
+    for cluster_name, (label, usage) in pairs:
+        nodes.append((cluster_name,) + label, usage)
+    return nodes
+
+
+TOP_NODE_HEADERS = ['EC2 INSTANCE ID', 'STATUS', 'TASKS', 'CPU', 'CPU%',
+                    'MEMORY', 'MEMORY%', 'PORTS', 'SKEW']
+TOP_NODE_COLUMNS = ['cpu', 'memory', 'ports', 'tasks', 'skew']
+
+
+@top.command(name='container-instance')
+@click.option('--cluster')
+@click.option('--all-clusters', is_flag=True, default=False,
+              help='Show the nodes of every cluster.')
+@click.option('--sort-by', type=click.Choice(TOP_NODE_COLUMNS),
+              default='cpu', show_default=True,
+              help='Column to sort by, highest first.')
+@threshold_option(TOP_NODE_COLUMNS)
+@click.pass_context
+def top_container_instance(ctx, cluster, all_clusters, sort_by,
+                           thresholds):
+    """Show the CPU, memory and ports reserved on each node.
+
+    SKEW is the difference between the CPU and memory percentages; a
+    node with a high skew has capacity that no task of the usual shape
+    can use. Totals per cluster are printed to stderr.
+    """
+    from .top import select
+    if not cluster:
+        cluster = ctx.obj['cluster']
+    bw = ctx.obj['bw']
+    nodes = fetch_node_usage(bw, cluster, all_clusters)
+    cpu = nodes.ratio('cpu', 'cpu_registered')
+    memory = nodes.ratio('memory', 'memory_registered')
+    keys = {
+        'cpu': cpu,
+        'memory': memory,
+        'ports': nodes['ports'],
+        'tasks': nodes['tasks'],
+        'skew': [abs(c - m) for c, m in zip(cpu, memory)],
+    }
+    rows = []
+    for i in select(len(nodes), keys, thresholds, sort_by=sort_by):
+        label = nodes.labels[i]
+        row = label[1:] + (
+            nodes['tasks'][i],
+            '%d/%d' % (nodes['cpu'][i], nodes['cpu_registered'][i]),
+            percent(cpu[i]),
+            '%d/%d' % (nodes['memory'][i], nodes['memory_registered'][i]),
+            percent(memory[i]),
+            nodes['ports'][i],
+            percent(keys['skew'][i]),
+        )
+        rows.append((label[0],) + row if all_clusters else row)
+    echo_table(rows, cluster_headers(TOP_NODE_HEADERS, all_clusters))
+    echo_cluster_totals(nodes)
+
+
+TOP_SERVICE_HEADERS = ['TASKS', 'CPU', 'CPU%', 'MEMORY', 'MEMORY%', 'PORTS']
+TOP_SERVICE_COLUMNS = ['cpu', 'memory', 'ports', 'tasks']
+
+
+def task_groups(task):
+    """Return (service or task group, family) of a task."""
+    group = task.get('group', '')
+    if group.startswith('service:'):
+        group = group[len('service:'):]
+    family, _ = parse_task_definition_arn(task['taskDefinitionArn'])
+    return group, family
+
+
+@top.command(name='service')
+@click.option('--cluster')
+@click.option('--all-clusters', is_flag=True, default=False,
+              help='Show the services of every cluster.')
+@click.option('--group-by', type=click.Choice(['service', 'family']),
+              default='service', show_default=True,
+              help='Add up tasks per service or per task definition '
+                   'family.')
+@click.option('--sort-by', type=click.Choice(TOP_SERVICE_COLUMNS),
+              default='cpu', show_default=True,
+              help='Column to sort by, highest first.')
+@threshold_option(TOP_SERVICE_COLUMNS)
+@click.pass_context
+def top_service(ctx, cluster, all_clusters, group_by, sort_by, thresholds):
+    """Show the CPU, memory and ports reserved by the running tasks of
+    each service (or task definition family).
+
+    Percentages are shares of the resources registered by the nodes of
+    the cluster. Tasks not started by a service are shown by their task
+    group (family:NAME). Totals per cluster are printed to stderr.
+    """
+    from .top import Columns, select, task_usage
+    if not cluster:
+        cluster = ctx.obj['cluster']
+    bw = ctx.obj['bw']
+    tasks = Columns(['cpu', 'memory', 'ports'])
+    pairs = fetch_records(bw, bw.get_tasks, cluster, all_clusters,
+                          lambda t: (task_groups(t), task_usage(t)))
+    for cluster_name, (groups, usage) in pairs:
+        tasks.append((cluster_name,) + groups, usage)
+    nodes = fetch_node_usage(bw, cluster, all_clusters)
+    registered = nodes.group_by(lambda label: label[0])
+    cluster_cpu = dict(zip(registered.labels, registered['cpu_registered']))
+    cluster_memory = dict(zip(registered.labels,
+                              registered['memory_registered']))
+    column = 1 if group_by == 'service' else 2
+    groups = tasks.group_by(lambda label: (label[0], label[column]))
+    cpu = [100.0 * used / cluster_cpu[c] if cluster_cpu.get(c)
+           else float('nan')
+           for (c, _), used in zip(groups.labels, groups['cpu'])]
+    memory = [100.0 * used / cluster_memory[c] if cluster_memory.get(c)
+              else float('nan')
+              for (c, _), used in zip(groups.labels, groups['memory'])]
+    keys = {
+        'cpu': cpu,
+        'memory': memory,
+        'ports': groups['ports'],
+        'tasks': groups['count'],
+    }
+    rows = []
+    for i in select(len(groups), keys, thresholds, sort_by=sort_by):
+        cluster_name, name = groups.labels[i]
+        row = (name, groups['count'][i], groups['cpu'][i], percent(cpu[i]),
+               groups['memory'][i], percent(memory[i]), groups['ports'][i])
+        rows.append((cluster_name,) + row if all_clusters else row)
+    headers = [group_by.upper()] + TOP_SERVICE_HEADERS
+    echo_table(rows, cluster_headers(headers, all_clusters))
+    echo_cluster_totals(nodes)
 
 
 @cli.command(short_help='Run a particular image on the cluster.')
 @click.option('--image', required=True)
 @click.option('--cluster')
+@click.option('--cpu', type=click.IntRange(min=0), default=1024,
+              show_default=True, help='CPU units reserved per task.')
+@click.option('--memory', type=click.IntRange(min=0), default=2048,
+              show_default=True, help='MiB of memory reserved per task.')
+@click.option('--count', type=click.IntRange(min=1), default=1,
+              show_default=True, help='Number of tasks to run.')
+@click.option('--dry-run', is_flag=True, default=False,
+              help='Simulate where the tasks would be placed; create '
+                   'nothing.')
 @click.argument('command', nargs=-1, required=False)
 @click.argument('name')
 @click.pass_context
-def run(ctx, name, image, cluster, command):
+def run(ctx, name, image, cluster, command, cpu, memory, count, dry_run):
     if not cluster:
         cluster = ctx.obj['cluster']
     bw = ctx.obj['bw']
-    bw.run(name=name, cluster=cluster, image=image, command=command)
+    if dry_run:
+        from .placement import Demand, simulate
+        click.echo('%s-svc: 0 -> %d (dry run)' % (name, count))
+        placement = simulate(placement_nodes(bw, cluster),
+                             Demand(cpu=cpu, memory=memory), count)
+        if not echo_placement(placement):
+            ctx.exit(1)
+        return
+    bw.run(name=name, cluster=cluster, image=image, command=command,
+           cpu=cpu, memory=memory, count=count)
+
+
+def echo_bulk_results(ctx, results, verb, describe):
+    """Print the outcome of a bulk action; exit 1 if any item failed."""
+    done = failed = 0
+    for item, resp, error in results:
+        if error is not None:
+            failed += 1
+            click.echo('%s: error: %s' % (item.rpartition('/')[-1], error),
+                       err=True)
+        else:
+            done += 1
+            click.echo(describe(resp))
+    if done + failed > 1:
+        click.echo('%d %s, %d failed.' % (done, verb, failed), err=True)
+    if failed:
+        ctx.exit(1)
+
+
+@cli.command(short_help='Deregister old task definition revisions.')
+@click.option('--family', help='Only collect revisions of this family.')
+@click.option('--family-prefix',
+              help='Only collect families whose name starts with this.')
+@click.option('--keep', type=click.IntRange(min=0),
+              help='Keep the latest N revisions of each family (default 1).')
+@click.option('--older-than', callback=parse_duration,
+              help='Only collect revisions registered longer ago than '
+                   'this, e.g. 30d.')
+@click.option('--unused', is_flag=True, default=False,
+              help='Only collect revisions that no service deployment or '
+                   'task of any cluster uses.')
+@click.option('--dry-run', is_flag=True, default=False,
+              help='Print the revisions that would be deregistered.')
+@click.option('--refresh', is_flag=True, default=False,
+              help='Rebuild the local index of ACTIVE revisions first.')
+@click.pass_context
+def gc(ctx, family, family_prefix, keep, older_than, unused, dry_run,
+       refresh):
+    """Deregister ACTIVE task definition revisions.
+
+    A revision is collected when it matches every policy given: it is
+    not one of the latest --keep revisions of its family, it is older
+    than --older-than and it is --unused. Revisions are deregistered in
+    parallel and paced like every other API call (see the rate_limits
+    config); a failure for one revision does not stop the others.
+    """
+    if keep is None and older_than is None and not unused:
+        raise click.UsageError('Give at least one of --keep, --older-than '
+                               'and --unused.')
+    if keep is None:
+        keep = 1
+    bw = ctx.obj['bw']
+    in_use = bw.task_definitions_in_use() if unused else set()
+    candidates = []
+    arns = bw.indexed_task_definitions(family=family,
+                                       family_prefix=family_prefix,
+                                       full_sync=refresh)
+    grouped = itertools.groupby(
+        arns, key=lambda arn: parse_task_definition_arn(arn)[0])
+    for _, revisions in grouped:
+        candidates.extend(arn for arn in itertools.islice(revisions, keep,
+                                                          None)
+                          if arn not in in_use)
+    if older_than is not None:
+        import pytz
+        # Described revisions are cached, so repeated runs are cheap.
+        cutoff = (datetime.datetime.now(pytz.utc) -
+                  datetime.timedelta(seconds=older_than))
+        infos = wrapboto.ordered_map(bw.describe_task_definition,
+                                     candidates, bw.concurrency)
+        # Revisions registered before ECS recorded registeredAt are kept.
+        candidates = [info['taskDefinitionArn'] for info in infos
+                      if info.get('registeredAt') and
+                      info['registeredAt'] < cutoff]
+    families = len(set(parse_task_definition_arn(arn)[0]
+                       for arn in candidates))
+    if dry_run:
+        for arn in candidates:
+            click.echo('%s (dry run)' % display.simple_task_definition(arn))
+        click.echo('%d revisions of %d families would be deregistered.'
+                   % (len(candidates), families), err=True)
+        return
+    results = bw.deregister_task_definitions(candidates)
+    echo_bulk_results(
+        ctx, results, 'deregistered',
+        lambda info: display.simple_task_definition(
+            info['taskDefinitionArn']))
 
 
-@cli.command(short_help='Set a new size for a service')
+def placement_nodes(bw, cluster):
+    """Nodes that can take new tasks, as placement.Node objects."""
+    from .placement import Node
+    return [Node(r) for r in bw.get_container_instances(cluster=cluster)
+            if r['status'] == 'ACTIVE' and r.get('agentConnected', True)]
+
+
+def simulate_service(bw, cluster, service, nodes, count):
+    """Simulate placing `count` more tasks of a service on `nodes`."""
+    from .placement import Demand, simulate
+    info = bw.describe_task_definition(service['taskDefinition'])
+    constraints = (service.get('placementConstraints', []) +
+                   info.get('placementConstraints', []))
+    candidates = nodes
+    expressions = ['(%s)' % c['expression'] for c in constraints
+                   if c['type'] == 'memberOf' and c.get('expression')]
+    if expressions:
+        arns = set(bw.all_container_instance_arns(
+            cluster=cluster, query=' and '.join(expressions)))
+        candidates = [node for node in nodes if node.arn in arns]
+    tasks = collections.Counter(
+        t.get('containerInstanceArn')
+        for t in bw.get_tasks(cluster, service=service['serviceName']))
+    for node in nodes:
+        node.tasks = tasks[node.arn]
+    distinct = any(c['type'] == 'distinctInstance' for c in constraints)
+    return simulate(candidates, Demand.from_task_definition(info), count,
+                    strategy=service.get('placementStrategy'),
+                    distinct=distinct)
+
+
+def echo_placement(placement):
+    """Print where simulated tasks went; return whether all of them fit."""
+    from .placement import AZ_FIELD
+    zones = placement.by_attribute()
+    click.echo('  %d of %d new tasks fit%s' % (
+        placement.placed, placement.count,
+        ': ' + ', '.join('%s %d' % (zone, zones[zone])
+                         for zone in sorted(zones, key=str))
+        if zones else ''))
+    for node in sorted(placement.nodes, key=lambda n: n.name):
+        click.echo('    %s  %s  +%d' % (node.name, node.attribute(AZ_FIELD),
+                                        placement.nodes[node]))
+    missing = placement.count - placement.placed
+    if missing:
+        reasons = ', '.join('%s %d' % (reason, n) for reason, n
+                            in placement.reasons.most_common())
+        click.echo('  %d would stay PENDING; nodes without room: %s'
+                   % (missing, reasons or 'none registered'))
+    return not missing
+
+
+@cli.command(short_help='Set a new size for services')
 @click.option('--cluster')
 @click.option('--replicas', type=int, required=True)
-@click.argument('service', required=True)
+@click.option('--prefix',
+              help='Scale every service whose name starts with this.')
+@click.option('--dry-run', is_flag=True, default=False,
+              help='Print the current and new sizes and simulate where '
+                   'new tasks would be placed; change nothing.')
+@click.argument('services', nargs=-1)
 @click.pass_context
-def scale(ctx, replicas, service, cluster):
+def scale(ctx, replicas, services, cluster, prefix, dry_run):
+    """Scale SERVICES and the services matching --prefix.
+
+    Services are updated in parallel; a failure for one service does not
+    stop the others. With --dry-run, the new tasks of every service are
+    placed in turn on the remaining resources of the container instances,
+    following the placement strategy and constraints of the service, and
+    the command exits with 1 if any of them would not fit.
+    """
     if not cluster:
         cluster = ctx.obj['cluster']
     bw = ctx.obj['bw']
-    resp = bw.scale_service(service, replicas, cluster=cluster)
-    output = resp['service']['serviceArn']
-    click.echo(output)
+    services = list(services)
+    if prefix is not None:
+        services.extend(
+            arn for arn in bw.all_service_arns(cluster=cluster)
+            if arn.rpartition('/')[-1].startswith(prefix))
+    if not services:
+        raise click.ClickException('No matching services.')
+    if dry_run:
+        nodes = None
+        fits = True
+        for r in list(bw.describe_services(services, cluster=cluster)):
+            click.echo('%s: %d -> %d (dry run)'
+                       % (r['serviceName'], r['desiredCount'], replicas))
+            count = replicas - r['desiredCount']
+            if count <= 0:
+                continue
+            if r.get('launchType') == 'FARGATE':
+                click.echo('  runs on Fargate, placement not simulated')
+                continue
+            if nodes is None:
+                nodes = placement_nodes(bw, cluster)
+            placement = simulate_service(bw, cluster, r, nodes, count)
+            fits = echo_placement(placement) and fits
+        if not fits:
+            ctx.exit(1)
+        return
+    results = bw.scale_services(services, replicas, cluster=cluster)
+    echo_bulk_results(ctx, results, 'scaled',
+                      lambda resp: resp['service']['serviceArn'])
+
+
+@cli.group(cls=AliasedGroup, short_help='Follow service deployments.')
+def rollout():
+    pass
+
+
+@rollout.command(name='status')
+@click.option('--cluster')
+@click.option('--all', 'all_services', is_flag=True, default=False,
+              help='Wait for every service of the cluster.')
+@click.option('--interval', type=float, default=2.0, show_default=True,
+              help='Seconds between polls; grows while nothing changes.')
+@click.option('--max-interval', type=float, default=30.0,
+              show_default=True, help='Longest time between polls.')
+@click.option('--timeout', type=float,
+              help='Give up after this many seconds.')
+@click.argument('services', nargs=-1)
+@click.pass_context
+def rollout_status(ctx, services, cluster, all_services, interval,
+                   max_interval, timeout):
+    """Wait until SERVICES (or all services) are stable.
+
+    Prints a line whenever the deployments of a service change. Exits
+    with 0 once every service is stable, 1 if any rollout failed or a
+    service does not exist, and 2 on timeout.
+    """
+    if not cluster:
+        cluster = ctx.obj['cluster']
+    bw = ctx.obj['bw']
+    services = list(services)
+    if all_services:
+        services.extend(bw.all_service_arns(cluster=cluster))
+    if not services:
+        raise click.UsageError('Give SERVICE names or --all.')
+    from .rollout import wait_for_rollouts, STABLE, FAILED
+
+    def report(name, state, message):
+        click.echo('%s: %s (%s)' % (name, state, message))
+    states = wait_for_rollouts(
+        lambda names: bw.describe_services(names, cluster=cluster),
+        services, interval=interval, max_interval=max_interval,
+        timeout=timeout, report=report,
+    )
+    stable = sum(1 for state in states.values() if state == STABLE)
+    failed = sum(1 for state in states.values() if state == FAILED)
+    waiting = len(states) - stable - failed
+    click.echo('%d stable, %d failed, %d still in progress.'
+               % (stable, failed, waiting), err=True)
+    if failed:
+        ctx.exit(1)
+    if waiting:
+        ctx.exit(2)
+
+
+@cli.command(short_help='Print service events.')
+@click.option('--cluster')
+@click.option('--all', 'all_services', is_flag=True, default=False,
+              help='Print the events of every service of the cluster.')
+@click.option('-f', '--follow', is_flag=True, default=False,
+              help='Keep printing new events as they happen.')
+@click.option('--interval', type=float, default=2.0, show_default=True,
+              help='Seconds between polls with --follow.')
+@click.option('--since', callback=parse_duration,
+              help='Only print events of this last period, e.g. 1h.')
+@click.argument('services', nargs=-1)
+@click.pass_context
+def events(ctx, services, cluster, all_services, follow, interval, since):
+    """Print the events of SERVICES (or all services) in time order.
+
+    Services are described 10 per call. With --follow, only events not
+    printed yet are printed on every poll, merged across services.
+    """
+    if not cluster:
+        cluster = ctx.obj['cluster']
+    bw = ctx.obj['bw']
+    services = list(services)
+    if all_services:
+        services.extend(bw.all_service_arns(cluster=cluster))
+    if not services:
+        raise click.UsageError('Give SERVICE names or --all.')
+    import pytz
+    from dateutil.tz import tzlocal
+    from .events import poll_events
+    if since is not None:
+        since = (datetime.datetime.now(pytz.utc) -
+                 datetime.timedelta(seconds=since))
+    pairs = poll_events(
+        lambda names: bw.describe_services(names, cluster=cluster),
+        services, since=since, follow=follow, interval=interval,
+    )
+    try:
+        for name, event in pairs:
+            created_at = event['createdAt'].astimezone(tzlocal())
+            click.echo('%s  %s  %s' % (
+                created_at.strftime('%Y-%m-%d %H:%M:%S'), name,
+                event['message']))
+    except KeyboardInterrupt:
+        pass
 
 
 @cli.group(cls=AliasedGroup,
@@ -396,14 +1589,45 @@ def stop():
 @click.option('--cluster')
 @click.option('--reason', default='Stopped with ecsctl')
 @click.option('--raw-response', default=False, show_default=True)
-@click.argument('task', required=True)
+@click.option('--service', help='Stop every task of this service.')
+@click.option('--family',
+              help='Stop every task of this task definition family.')
+@click.option('--field-selector',
+              callback=selector_callback(parse_field_selector),
+              help='Stop every task matching path=value[,...].')
+@click.option('--dry-run', is_flag=True, default=False,
+              help='Print the tasks that would be stopped, stop nothing.')
+@click.argument('tasks', nargs=-1)
 @click.pass_context
-def stop_task(ctx, task, cluster, reason, raw_response):
+def stop_task(ctx, tasks, cluster, reason, raw_response, service, family,
+              field_selector, dry_run):
+    """Stop TASKS and the tasks matching --service, --family and
+    --field-selector.
+
+    Tasks are stopped in parallel; a failure for one task does not stop
+    the others.
+    """
     if not cluster:
         cluster = ctx.obj['cluster']
     bw = ctx.obj['bw']
-    resp = bw.stop_task(task, cluster=cluster, reason=reason)
-    if raw_response:
-        click.echo(display.de_unicode(resp['task']))
-    else:
-        click.echo(resp['task']['taskArn'])
+    tasks = list(tasks)
+    if field_selector:
+        matching = bw.get_tasks(cluster=cluster, service=service,
+                                family=family)
+        tasks.extend(t['taskArn'] for t in matching if field_selector(t))
+    elif service or family:
+        tasks.extend(bw.all_tasks(cluster=cluster, service=service,
+                                  family=family))
+    if not tasks:
+        raise click.ClickException('No matching tasks.')
+    if dry_run:
+        for task in tasks:
+            click.echo('%s (dry run)' % task)
+        return
+
+    def describe(resp):
+        if raw_response:
+            return display.de_unicode(resp['task'])
+        return resp['task']['taskArn']
+    results = bw.stop_tasks(tasks, cluster=cluster, reason=reason)
+    echo_bulk_results(ctx, results, 'stopped', describe)
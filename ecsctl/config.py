@@ -4,16 +4,24 @@ import click
 from configparser import RawConfigParser
 
 
-__all__ = ['read_config', 'update_config', 'default_config']
+__all__ = ['read_config', 'update_config', 'default_config', 'CACHE_FILE',
+           'INDEX_FILE']
 
 APP_NAME = SECTION = 'ecsctl'
 APP_DIR = click.get_app_dir(APP_NAME)
 CONFIG_FILE = os.path.join(APP_DIR, 'config')
+CACHE_FILE = os.path.join(APP_DIR, 'cache.sqlite')
+INDEX_FILE = os.path.join(APP_DIR, 'index.sqlite')
 
 default_config = {
     'cluster': 'default',
     'docker_port': 2375,
     'docker_api_version': '1.24',
+    'concurrency': 8,
+    'cache_size_mb': 64,
+    'index_ttl': 300,
+    'rate_limit': 20,
+    'rate_limits': '',
 }
 
 
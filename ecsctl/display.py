@@ -1,5 +1,7 @@
 
+import itertools
 import json
+import numbers
 from datetime import datetime
 
 
@@ -24,3 +26,61 @@ def simple_task(arn):
 
 def de_unicode(content):
     return json.dumps(content, indent=4, default=json_serial)
+
+
+def format_row(row, widths, numeric):
+    cells = []
+    for cell, width, right in zip(row, widths, numeric):
+        cell = str(cell)
+        cells.append(cell.rjust(width) if right else cell.ljust(width))
+    return '  '.join(cells).rstrip()
+
+
+def table_layout(rows, headers):
+    """Return the column widths and numeric (right-aligned) columns."""
+    widths = [len(h) for h in headers]
+    for row in rows:
+        widths = [max(w, len(str(c))) for w, c in zip(widths, row)]
+    if rows:
+        numeric = [isinstance(c, numbers.Number) for c in rows[0]]
+    else:
+        numeric = [False] * len(headers)
+    return widths, numeric
+
+
+def stream_table(rows, headers, sample_size=100):
+    """Yield the lines of a plain table as rows arrive.
+
+    Column widths are computed from the headers and the first
+    `sample_size` rows only. Later rows are padded to the same widths
+    (longer cells overflow), so output starts without waiting for the
+    remaining rows to be fetched.
+    """
+    rows = iter(rows)
+    sample = list(itertools.islice(rows, sample_size))
+    widths, numeric = table_layout(sample, headers)
+    yield format_row(headers, widths, numeric)
+    for row in itertools.chain(sample, rows):
+        yield format_row(row, widths, numeric)
+
+
+def stream_json(records):
+    """Yield the lines of a JSON array of `records`, one record at a time."""
+    yield '['
+    previous = None
+    for record in records:
+        if previous is not None:
+            yield previous + ','
+        previous = '    ' + de_unicode(record).replace('\n', '\n    ')
+    if previous is not None:
+        yield previous
+    yield ']'
+
+
+def json_line(record):
+    return json.dumps(record, default=json_serial)
+
+
+def stream_json_lines(records):
+    for record in records:
+        yield json_line(record)
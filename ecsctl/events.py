@@ -0,0 +1,52 @@
+import time
+
+
+def new_events(service, last_id=None, since=None):
+    """Return the events of a service newer than the event `last_id`
+    (and not older than the datetime `since`), oldest first.
+
+    ECS returns the latest 100 events of a service, newest first.
+    """
+    events = []
+    for event in service.get('events', []):
+        if event['id'] == last_id:
+            break
+        if since is not None and event['createdAt'] < since:
+            break
+        events.append(event)
+    events.reverse()
+    return events
+
+
+def poll_events(describe, services, since=None, follow=False,
+                interval=2.0):
+    """Yield (service name, event) of `services`, oldest first.
+
+    Every poll describes all the services at once (`describe` is called
+    like in rollout.wait_for_rollouts) and merges their new events by
+    time. The ID of the newest event yielded is kept per service, so an
+    event is never yielded twice. Without `follow`, the events already
+    there are yielded once; with it, the services are polled every
+    `interval` seconds until the generator is closed.
+    """
+    last_ids = {}
+    while True:
+        started = time.time()
+        batch = []
+        for service in describe(services):
+            name = service['serviceName']
+            events = new_events(service, last_ids.get(name),
+                                since if name not in last_ids else None)
+            if events:
+                last_ids[name] = events[-1]['id']
+            elif name not in last_ids:
+                # Start from the newest event even if it was too old.
+                last_ids[name] = (service['events'][0]['id']
+                                  if service.get('events') else None)
+            batch.extend((name, event) for event in events)
+        batch.sort(key=lambda item: item[1]['createdAt'])
+        for item in batch:
+            yield item
+        if not follow:
+            return
+        time.sleep(max(0, interval - (time.time() - started)))
@@ -0,0 +1,163 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS task_definitions (
+    scope TEXT NOT NULL,
+    family TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    arn TEXT NOT NULL,
+    PRIMARY KEY (scope, family, revision)
+);
+CREATE TABLE IF NOT EXISTS synced (
+    scope TEXT PRIMARY KEY,
+    at REAL NOT NULL
+);
+'''
+
+
+def parse_task_definition_arn(arn):
+    """Return (family, revision) of a task definition ARN."""
+    family, _, revision = arn.rpartition('/')[-1].rpartition(':')
+    return family, int(revision)
+
+
+# Seconds a synced index is trusted without asking ECS again.
+DEFAULT_TTL = 300
+
+
+class TaskDefinitionIndex:
+    """The ACTIVE task definition revisions of each family, in sqlite.
+
+    Entries are grouped by a scope (profile and region), so one file
+    serves every account ecsctl is used with. The index only stores what
+    it is told; BotoWrapper.sync_task_definitions keeps it up to date.
+    A scope synced less than `ttl` seconds ago is fresh and is not synced
+    again. Use ':memory:' as path for an index that lives as long as the
+    process.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            conn = sqlite3.connect(self.path, timeout=10,
+                                   check_same_thread=False)
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def synced_at(self, scope):
+        """When the scope was last synced, or None if it never was."""
+        rows = self._query('SELECT at FROM synced WHERE scope = ?', (scope,))
+        return rows[0][0] if rows else None
+
+    def is_synced(self, scope):
+        return self.synced_at(scope) is not None
+
+    def is_fresh(self, scope):
+        at = self.synced_at(scope)
+        return at is not None and time.time() - at < self.ttl
+
+    def mark_synced(self, scope):
+        with self._lock:
+            with self.conn:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO synced (scope, at) '
+                    'VALUES (?, ?)', (scope, time.time()),
+                )
+
+    def count(self, scope):
+        rows = self._query('SELECT COUNT(*) FROM task_definitions '
+                           'WHERE scope = ?', (scope,))
+        return rows[0][0]
+
+    def families(self, scope, family_prefix=None):
+        rows = self._query('SELECT DISTINCT family FROM task_definitions '
+                           'WHERE scope = ? ORDER BY family', (scope,))
+        families = [family for family, in rows]
+        if family_prefix:
+            families = [f for f in families if f.startswith(family_prefix)]
+        return families
+
+    def max_revision(self, scope, family):
+        rows = self._query('SELECT MAX(revision) FROM task_definitions '
+                           'WHERE scope = ? AND family = ?', (scope, family))
+        return rows[0][0]
+
+    def revisions(self, scope, family, limit=None):
+        """Return the ARNs of the revisions of a family, newest first."""
+        sql = ('SELECT arn FROM task_definitions '
+               'WHERE scope = ? AND family = ? ORDER BY revision DESC')
+        params = (scope, family)
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params += (limit,)
+        return [arn for arn, in self._query(sql, params)]
+
+    @staticmethod
+    def _rows(scope, arns):
+        return [(scope,) + parse_task_definition_arn(arn) + (arn,)
+                for arn in arns]
+
+    def add(self, scope, arns):
+        rows = self._rows(scope, arns)
+        with self._lock:
+            with self.conn:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO task_definitions '
+                    '(scope, family, revision, arn) VALUES (?, ?, ?, ?)',
+                    rows,
+                )
+
+    def remove(self, scope, arns):
+        rows = [(scope,) + parse_task_definition_arn(arn) for arn in arns]
+        with self._lock:
+            with self.conn:
+                self.conn.executemany(
+                    'DELETE FROM task_definitions '
+                    'WHERE scope = ? AND family = ? AND revision = ?',
+                    rows,
+                )
+
+    def remove_family(self, scope, family, above=0):
+        """Forget the revisions of a family newer than `above`."""
+        with self._lock:
+            with self.conn:
+                self.conn.execute(
+                    'DELETE FROM task_definitions '
+                    'WHERE scope = ? AND family = ? AND revision > ?',
+                    (scope, family, above),
+                )
+
+    def replace(self, scope, arns):
+        """Replace every entry of the scope and mark it as synced."""
+        rows = self._rows(scope, arns)
+        with self._lock:
+            with self.conn:
+                self.conn.execute('DELETE FROM task_definitions '
+                                  'WHERE scope = ?', (scope,))
+                self.conn.executemany(
+                    'INSERT INTO task_definitions '
+                    '(scope, family, revision, arn) VALUES (?, ?, ?, ?)',
+                    rows,
+                )
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO synced (scope, at) '
+                    'VALUES (?, ?)', (scope, time.time()),
+                )
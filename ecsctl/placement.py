@@ -0,0 +1,167 @@
+"""Predict where ECS would place new tasks on container instances.
+
+The simulation follows the placement strategies services use: an
+optional spread over an attribute (such as the availability zone) picks
+a group of nodes, then the other strategies (spread over instances,
+binpack on cpu or memory) pick a node of that group. A node's key only
+changes when a task is placed on it, so every group keeps its nodes in a
+heap and placing a task costs O(log n).
+"""
+import collections
+import heapq
+
+from .top import container_memory, resource, units
+
+
+AZ_FIELD = 'attribute:ecs.availability-zone'
+
+# What ECS uses for a service created without a placement strategy.
+DEFAULT_STRATEGY = [
+    {'type': 'spread', 'field': AZ_FIELD},
+    {'type': 'spread', 'field': 'instanceId'},
+]
+
+
+class Node:
+    __slots__ = ('arn', 'name', 'cpu', 'memory', 'ports', 'attributes',
+                 'tasks')
+
+    def __init__(self, record):
+        remaining = record.get('remainingResources', [])
+        self.arn = record['containerInstanceArn']
+        self.name = record.get('ec2InstanceId') or self.arn
+        self.cpu = resource(remaining, 'CPU')
+        self.memory = resource(remaining, 'MEMORY')
+        self.ports = set()
+        for name, protocol in (('PORTS', 'tcp'), ('PORTS_UDP', 'udp')):
+            for r in remaining:
+                if r['name'] == name:
+                    self.ports.update((protocol, int(port))
+                                      for port in r.get('stringSetValue', []))
+        self.attributes = dict((a['name'], a.get('value'))
+                               for a in record.get('attributes', []))
+        # Tasks of the group being placed (e.g. of one service).
+        self.tasks = 0
+
+    def attribute(self, field):
+        return self.attributes.get(field[len('attribute:'):])
+
+
+class Demand:
+    """CPU units, MiB of memory and host ports one task reserves."""
+
+    def __init__(self, cpu=0, memory=0, ports=()):
+        self.cpu = cpu
+        self.memory = memory
+        self.ports = frozenset(ports)
+
+    @classmethod
+    def from_task_definition(cls, info):
+        containers = info.get('containerDefinitions', [])
+        cpu = units(info.get('cpu'))
+        if not cpu:
+            cpu = sum(units(c.get('cpu')) for c in containers)
+        memory = units(info.get('memory'))
+        if not memory:
+            memory = sum(container_memory(c) for c in containers)
+        ports = []
+        network_mode = info.get('networkMode', 'bridge')
+        if network_mode != 'awsvpc':
+            for c in containers:
+                for mapping in c.get('portMappings', []):
+                    port = mapping.get('hostPort')
+                    if network_mode == 'host':
+                        port = port or mapping.get('containerPort')
+                    if port:
+                        ports.append((mapping.get('protocol', 'tcp'), port))
+        return cls(cpu, memory, ports)
+
+
+def shortage(node, demand, distinct=False):
+    """Why a node cannot take one more task, or None if it can."""
+    if node.cpu < demand.cpu:
+        return 'cpu'
+    if node.memory < demand.memory:
+        return 'memory'
+    if demand.ports & node.ports:
+        return 'ports'
+    if distinct and node.tasks:
+        return 'distinctInstance'
+    return None
+
+
+class Placement:
+    """Outcome of a simulation: new tasks per node and what did not fit."""
+
+    def __init__(self, count):
+        self.count = count
+        # Nodes in the order they got their first task.
+        self.nodes = collections.OrderedDict()
+        self.reasons = collections.Counter()
+
+    @property
+    def placed(self):
+        return sum(self.nodes.values())
+
+    def by_attribute(self, field=AZ_FIELD):
+        totals = collections.Counter()
+        for node, placed in self.nodes.items():
+            totals[node.attribute(field)] += placed
+        return totals
+
+
+def simulate(nodes, demand, count, strategy=None, distinct=False):
+    """Place `count` tasks of `demand` on `nodes`, updating them.
+
+    `nodes` are Node objects whose `tasks` count the tasks of the same
+    group (service) already there, used by spread strategies. A random
+    strategy is simulated like a spread over instances.
+    """
+    strategy = list(strategy or DEFAULT_STRATEGY)
+    group_field = None
+    if (strategy and strategy[0]['type'] == 'spread' and
+            strategy[0].get('field', '').startswith('attribute:')):
+        group_field = strategy.pop(0)['field']
+
+    def key(node):
+        rv = []
+        for s in strategy:
+            field = s.get('field', '').lower()
+            if s['type'] == 'binpack':
+                rv.append(node.cpu if field == 'cpu' else node.memory)
+            elif s['type'] == 'spread' and field in ('instanceid', 'host'):
+                rv.append(node.tasks)
+        # Ties go to the node with the fewest tasks, then in node order.
+        rv.append(node.tasks)
+        return tuple(rv)
+
+    heaps = {}
+    group_tasks = collections.Counter()
+    for i, node in enumerate(nodes):
+        group = node.attribute(group_field) if group_field else None
+        group_tasks[group] += node.tasks
+        if shortage(node, demand, distinct) is None:
+            heaps.setdefault(group, []).append((key(node), i, node))
+    for heap in heaps.values():
+        heapq.heapify(heap)
+    placement = Placement(count)
+    for _ in range(count):
+        if not heaps:
+            break
+        group = min(heaps, key=lambda g: (group_tasks[g], str(g)))
+        heap = heaps[group]
+        _, i, node = heapq.heappop(heap)
+        node.cpu -= demand.cpu
+        node.memory -= demand.memory
+        node.ports |= demand.ports
+        node.tasks += 1
+        group_tasks[group] += 1
+        placement.nodes[node] = placement.nodes.get(node, 0) + 1
+        if shortage(node, demand, distinct) is None:
+            heapq.heappush(heap, (key(node), i, node))
+        elif not heap:
+            del heaps[group]
+    if placement.placed < count:
+        for node in nodes:
+            placement.reasons[shortage(node, demand, distinct)] += 1
+    return placement
@@ -1,6 +1,40 @@
 
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
 import docker
 import dockerpty
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+
+from . import timings
+from .wrapboto import ordered_map
+
+CONTAINER_NAME_LABEL = 'com.amazonaws.ecs.container-name'
+TASK_ARN_LABEL = 'com.amazonaws.ecs.task-arn'
+
+# Times exec_inspect is asked again (0.1s apart) for a finished exec.
+EXIT_CODE_POLLS = 20
+
+
+def docker_client(base_url, pool_size=None, **kwargs):
+    client = docker.APIClient(base_url, **kwargs)
+    if pool_size is not None:
+        # docker-py ignores max_pool_size for tcp:// daemons, which are
+        # served by the plain requests adapter (10 connections).
+        client.mount('http://', HTTPAdapter(pool_maxsize=pool_size))
+    recorder = timings.get_recorder()
+    if recorder is not None:
+        client = recorder.wrap_docker(client)
+    return client
 
 
 class Pty:
@@ -16,6 +50,8 @@ class Pty:
         self.cluster = cluster
         self.container = container
         self.api_version = api_version
+        self.task_arn = None
+        self.container_instance = None
 
     def get_ecs_hostname_of_task(self):
         info = self.bw.describe_task(self.task, cluster=self.cluster)
@@ -24,31 +60,26 @@ class Pty:
         first_container_name = ecs_containers[0]['name']
         if info['launchType'] == 'FARGATE':
             raise Exception('"exec" does not work with FARGATE.')
-        container_instance = info['containerInstanceArn']
-        node_info = self.bw.describe_container_instance(
-            container_instance,
+        self.task_arn = info['taskArn']
+        self.container_instance = info['containerInstanceArn']
+        hostname = self.bw.container_instance_address(
+            self.container_instance,
             cluster=self.cluster,
         )
-        ec2_instance_id = node_info['ec2InstanceId']
-        ec2_info = self.bw.describe_instance(ec2_instance_id)
-        return first_container_name, ec2_info['PrivateIpAddress'], ecs_containers_id
+        return first_container_name, hostname, ecs_containers_id
 
     def find_container_id(self, client, container_name):
-        containers = client.containers()
-        for container in containers:
-            labels = container.get('Labels')
-            if not labels:
-                continue
-            name = labels.get('com.amazonaws.ecs.container-name')
-            if name == container_name:
-                return container['Id']
-        else:
+        labels = ['%s=%s' % (CONTAINER_NAME_LABEL, container_name)]
+        if self.task_arn is not None:
+            labels.append('%s=%s' % (TASK_ARN_LABEL, self.task_arn))
+        containers = client.containers(filters={'label': labels})
+        if not containers:
             raise Exception('container not found.')
+        return containers[0]['Id']
 
-    def exec_command(self):
-        first_container_name, hostname, container_id = self.get_ecs_hostname_of_task()
+    def create_exec(self, hostname, container_id):
         docker_url = '%s:%d' % (hostname, self.port)
-        client = docker.APIClient(
+        client = docker_client(
             docker_url,
             version=self.api_version,
         )
@@ -58,5 +89,295 @@ class Pty:
         resp = client.exec_create(
             container_id, self.command, stdin=self.stdin, tty=self.tty
         )
-        exec_id = resp['Id']
+        return client, resp['Id']
+
+    def exec_command(self):
+        _, hostname, container_id = self.get_ecs_hostname_of_task()
+        try:
+            client, exec_id = self.create_exec(hostname, container_id)
+        except ConnectionError:
+            # The address may come from the local index and be stale;
+            # look it up again and retry once if it changed.
+            self.bw.forget_container_instance_address(
+                self.container_instance)
+            _, fresh_hostname, _ = self.get_ecs_hostname_of_task()
+            if fresh_hostname == hostname:
+                raise
+            client, exec_id = self.create_exec(fresh_hostname, container_id)
         dockerpty.start_exec(client, exec_id, interactive=self.stdin)
+
+
+class TaskHosts:
+    """Docker clients for the container instances of many tasks.
+
+    Tasks are given as described task records. Container instance
+    addresses are resolved once per instance, and one docker.APIClient
+    is shared by every task on the same host.
+    """
+
+    def __init__(self, bw=None, tasks=(), port=2375, cluster='default',
+                 api_version=None, container=None, concurrency=8):
+        self.bw = bw
+        self.tasks = list(tasks)
+        self.port = port
+        self.cluster = cluster
+        self.api_version = api_version
+        self.container = container
+        self.concurrency = concurrency
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def container_id_of(self, task):
+        containers = task['containers']
+        if self.container is None:
+            return containers[0]['runtimeId']
+        for container in containers:
+            if container['name'] == self.container:
+                return container['runtimeId']
+        raise Exception('container not found.')
+
+    def resolve_hosts(self):
+        # Tasks that are not placed yet have no container instance.
+        nodes = sorted(set(t['containerInstanceArn'] for t in self.tasks
+                           if t.get('containerInstanceArn')))
+
+        def resolve(node):
+            try:
+                return self.bw.container_instance_address(
+                    node, cluster=self.cluster,
+                )
+            except Exception as e:
+                return e
+        addresses = ordered_map(resolve, nodes, self.concurrency)
+        for node, address in zip(nodes, addresses):
+            if isinstance(address, Exception):
+                self.clients[node] = address
+                continue
+            docker_url = '%s:%d' % (address, self.port)
+            self.clients[node] = docker_client(
+                docker_url,
+                version=self.api_version,
+                pool_size=self.concurrency,
+            )
+
+    def client_of(self, task, action):
+        if task.get('launchType') == 'FARGATE':
+            raise Exception('"%s" does not work with FARGATE.' % action)
+        node = task.get('containerInstanceArn')
+        if node is None:
+            raise Exception('task is not placed yet (%s).'
+                            % task.get('lastStatus', 'PENDING'))
+        client = self.clients[node]
+        if isinstance(client, Exception):
+            raise client
+        return client
+
+
+class FanOutExec(TaskHosts):
+    """Run one non-interactive command in many tasks at once.
+
+    Output lines are passed to `emit(task_id, line)` as they arrive;
+    calls to it are serialized.
+    """
+
+    def __init__(self, bw=None, tasks=(), command=(), port=2375,
+                 cluster='default', api_version=None, container=None,
+                 concurrency=8):
+        TaskHosts.__init__(self, bw=bw, tasks=tasks, port=port,
+                           cluster=cluster, api_version=api_version,
+                           container=container, concurrency=concurrency)
+        self.command = command
+
+    def run_one(self, task, emit):
+        task_id = task['taskArn'].rpartition('/')[-1]
+        client = self.client_of(task, 'exec')
+        container_id = self.container_id_of(task)
+        exec_id = client.exec_create(container_id, self.command)['Id']
+        pending = b''
+        for chunk in client.exec_start(exec_id, stream=True):
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                self.emit(emit, task_id, line)
+        if pending:
+            self.emit(emit, task_id, pending)
+        # The exit code may lag behind the end of the output stream.
+        info = client.exec_inspect(exec_id)
+        for _ in range(EXIT_CODE_POLLS):
+            if not info.get('Running'):
+                break
+            time.sleep(0.1)
+            info = client.exec_inspect(exec_id)
+        return info['ExitCode']
+
+    def emit(self, emit, task_id, line):
+        with self.lock:
+            emit(task_id, line.decode('utf-8', 'replace'))
+
+    def run(self, emit):
+        """Run the command everywhere; return [(task_arn, code, error)]."""
+        self.resolve_hosts()
+
+        def run_task(task):
+            try:
+                return self.run_one(task, emit), None
+            except ConnectionError as e:
+                self.bw.forget_container_instance_address(
+                    task['containerInstanceArn'])
+                return None, str(e)
+            except Exception as e:
+                return None, str(e)
+        results = ordered_map(run_task, self.tasks, self.concurrency)
+        return [(task['taskArn'], code, error)
+                for task, (code, error) in zip(self.tasks, results)]
+
+
+def split_timestamp(line):
+    """Split a docker log line into a sortable timestamp and the text.
+
+    Docker trims trailing zeros of the fraction of RFC 3339 timestamps,
+    so the fraction is padded for the timestamps to sort as strings.
+    """
+    timestamp, _, text = line.partition(' ')
+    if not timestamp.endswith('Z'):
+        return timestamp, text
+    seconds, dot, fraction = timestamp[:-1].partition('.')
+    return '%s.%sZ' % (seconds, fraction.ljust(9, '0')), text
+
+
+class FanOutLogs(TaskHosts):
+    """Read the logs of one container in many tasks, merged by time.
+
+    Every task is read through its own streaming request, and up to
+    `concurrency` requests are sent at once. Without `follow`, the
+    streams are opened in parallel and merged with heapq.merge, which
+    holds one line per task. With `follow`, `concurrency` threads read
+    one task each (the next one once a stream ends) and feed a bounded
+    queue; lines are held back for up to `delay` seconds so that lines
+    arriving from different hosts at about the same time come out in
+    timestamp order.
+    """
+
+    def __init__(self, bw=None, tasks=(), port=2375, cluster='default',
+                 api_version=None, container=None, concurrency=8,
+                 follow=False, since=None, tail='all', delay=1.0,
+                 queue_size=1000):
+        TaskHosts.__init__(self, bw=bw, tasks=tasks, port=port,
+                           cluster=cluster, api_version=api_version,
+                           container=container, concurrency=concurrency)
+        self.follow = follow
+        self.since = since
+        self.tail = tail
+        self.delay = delay
+        self.queue_size = queue_size
+        self.errors = []
+
+    def read(self, task):
+        """Yield (timestamp, task ID, text) for every line of a task."""
+        task_id = task['taskArn'].rpartition('/')[-1]
+        try:
+            client = self.client_of(task, 'logs')
+            chunks = client.logs(self.container_id_of(task), stream=True,
+                                 timestamps=True, follow=self.follow,
+                                 since=self.since, tail=self.tail)
+            pending = b''
+            for chunk in chunks:
+                lines = (pending + chunk).split(b'\n')
+                pending = lines.pop()
+                for line in lines:
+                    yield self.parse(task_id, line)
+            if pending:
+                yield self.parse(task_id, pending)
+        except Exception as e:
+            if isinstance(e, ConnectionError):
+                self.bw.forget_container_instance_address(
+                    task['containerInstanceArn'])
+            with self.lock:
+                self.errors.append((task['taskArn'], str(e)))
+
+    @staticmethod
+    def parse(task_id, line):
+        timestamp, text = split_timestamp(line.decode('utf-8', 'replace'))
+        return timestamp, task_id, text
+
+    def open_stream(self, task):
+        """Read the first line of a task, so that its request is sent.
+
+        Returns an iterator over every line of the task.
+        """
+        lines = self.read(task)
+        for line in lines:
+            return itertools.chain([line], lines)
+        return iter(())
+
+    def lines(self):
+        """Yield (timestamp, task ID, text) of every task in time order.
+
+        Tasks whose logs cannot be read are left out and recorded in
+        `errors` as (task ARN, message).
+        """
+        self.resolve_hosts()
+        if not self.follow:
+            streams = ordered_map(self.open_stream, self.tasks,
+                                  self.concurrency)
+            return heapq.merge(*streams)
+        return self.follow_lines()
+
+    def follow_lines(self):
+        lines = queue.Queue(maxsize=self.queue_size)
+        tasks = queue.Queue()
+        done = object()
+
+        def pump():
+            while True:
+                try:
+                    task = tasks.get_nowait()
+                except queue.Empty:
+                    break
+                for line in self.read(task):
+                    lines.put(line)
+            lines.put(done)
+        for task in self.tasks:
+            tasks.put(task)
+        running = min(self.concurrency, len(self.tasks))
+        for _ in range(running):
+            thread = threading.Thread(target=pump)
+            thread.daemon = True
+            thread.start()
+        # Lines wait in `held` by timestamp; `arrivals` has their
+        # sequence numbers in arrival order.
+        held = []
+        arrivals = collections.deque()
+        released = set()
+        sequence = itertools.count()
+        while running or held:
+            timeout = self.delay
+            if arrivals:
+                timeout = max(0, arrivals[0][0] + self.delay - time.time())
+            try:
+                line = lines.get(timeout=timeout) if running else None
+            except queue.Empty:
+                line = None
+            if line is done:
+                running -= 1
+            elif line is not None:
+                number = next(sequence)
+                heapq.heappush(held, (line[0], number, line))
+                arrivals.append((time.time(), number))
+            # No line is held longer than `delay`: once the line that
+            # arrived first is due, it goes out with every line of an
+            # earlier timestamp. Lines of hosts whose clocks are further
+            # apart than `delay` can come out of order.
+            now = time.time()
+            while arrivals and (not running or
+                                arrivals[0][0] + self.delay <= now):
+                _, due = arrivals.popleft()
+                if due in released:
+                    released.remove(due)
+                    continue
+                while True:
+                    _, number, line = heapq.heappop(held)
+                    yield line
+                    if number == due:
+                        break
+                    released.add(number)
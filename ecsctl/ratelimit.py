@@ -0,0 +1,135 @@
+import random
+import threading
+import time
+
+
+DEFAULT_RATE = 20.0
+MIN_RATE = 1.0
+
+# time.monotonic is not there on Python 2.
+clock = getattr(time, 'monotonic', time.time)
+
+THROTTLING_ERRORS = frozenset([
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestLimitExceeded',
+    'TooManyRequestsException',
+])
+
+
+def parse_rates(spec):
+    """Parse ``DescribeTasks=20,ListTasks=5`` into a dict of rates."""
+    rates = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        operation, sep, rate = item.partition('=')
+        operation = operation.strip()
+        try:
+            rate = float(rate)
+        except ValueError:
+            rate = 0
+        if not sep or not operation or rate <= 0:
+            raise ValueError('Invalid rate %r, expected Operation=RATE.'
+                             % item)
+        rates[operation] = rate
+    return rates
+
+
+class TokenBucket:
+    """Paces calls to `rate` per second, adapting it to throttling.
+
+    Calls are spaced evenly rather than allowed to burst, since ECS
+    throttles on short windows. The rate is halved (at most once per
+    second) when a call is throttled and grows back by about one call
+    per second every second while calls succeed, up to the configured
+    maximum. Waiting callers get a little jitter so that threads
+    released together do not hit the API in lockstep.
+    """
+
+    def __init__(self, rate):
+        self.max_rate = rate
+        self.rate = rate
+        self.tokens = 1.0
+        self.updated = clock()
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = clock()
+            elapsed = now - self.updated
+            self.tokens = min(1.0, self.tokens + elapsed * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return
+            wait = -self.tokens / self.rate
+        time.sleep(wait * (1 + random.random() * 0.1))
+
+    def on_throttle(self):
+        with self.lock:
+            now = clock()
+            if now - self.last_decrease < 1.0:
+                return
+            self.last_decrease = now
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+
+    def on_success(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + 1.0 / self.rate)
+
+
+class RateLimiter:
+    """Client-side pacing of API calls, one bucket per operation.
+
+    Register it on every boto3 client of a BotoWrapper so that all
+    threads share the same buckets. Retries of throttled calls are left
+    to botocore (exponential backoff with jitter); they go through the
+    bucket like any other attempt.
+    """
+
+    def __init__(self, default_rate=DEFAULT_RATE, rates=None):
+        self.default_rate = default_rate
+        self.rates = rates or {}
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, operation):
+        bucket = self.buckets.get(operation)
+        if bucket is None:
+            with self.lock:
+                bucket = self.buckets.get(operation)
+                if bucket is None:
+                    rate = self.rates.get(operation, self.default_rate)
+                    bucket = self.buckets[operation] = TokenBucket(rate)
+        return bucket
+
+    def register(self, client):
+        events = client.meta.events
+        events.register('before-send', self._before_send)
+        events.register('needs-retry', self._needs_retry)
+        events.register('after-call', self._after_call)
+
+    @staticmethod
+    def _operation(event_name):
+        return event_name.rpartition('.')[-1]
+
+    def _before_send(self, event_name, **kwargs):
+        self.bucket(self._operation(event_name)).acquire()
+
+    def _needs_retry(self, event_name, response=None, **kwargs):
+        if response is None:
+            return None
+        code = response[1].get('Error', {}).get('Code')
+        if code in THROTTLING_ERRORS:
+            self.bucket(self._operation(event_name)).on_throttle()
+        return None
+
+    def _after_call(self, event_name, http_response=None, **kwargs):
+        if http_response is not None and http_response.status_code < 400:
+            self.bucket(self._operation(event_name)).on_success()
@@ -0,0 +1,94 @@
+import time
+
+
+STABLE = 'stable'
+FAILED = 'failed'
+PROGRESSING = 'progressing'
+
+
+def rollout_state(service):
+    """Return (state, message) describing the deployments of a service.
+
+    A service is stable once its only deployment runs the desired number
+    of tasks (and, with the deployment circuit breaker, its rollout is
+    COMPLETED). It has failed if it is no longer active or any of its
+    deployments has a FAILED rollout.
+    """
+    if service['status'] != 'ACTIVE':
+        return FAILED, 'service is %s' % service['status']
+    deployments = service.get('deployments', [])
+    primary = None
+    for deployment in deployments:
+        if deployment['status'] == 'PRIMARY':
+            primary = deployment
+    if primary is None:
+        return PROGRESSING, 'no primary deployment'
+    message = '%d/%d running, %d pending' % (primary['runningCount'],
+                                             primary['desiredCount'],
+                                             primary['pendingCount'])
+    if len(deployments) > 1:
+        message += ', %d deployments' % len(deployments)
+    rollout = primary.get('rolloutState')
+    if rollout:
+        message += ', %s' % rollout
+    for deployment in deployments:
+        if deployment.get('rolloutState') == 'FAILED':
+            reason = deployment.get('rolloutStateReason')
+            return FAILED, '%s: %s' % (message, reason) if reason else message
+    if (len(deployments) == 1 and
+            primary['runningCount'] == primary['desiredCount'] and
+            primary['pendingCount'] == 0 and
+            rollout in (None, 'COMPLETED')):
+        return STABLE, message
+    return PROGRESSING, message
+
+
+def service_name(service):
+    return service.rpartition('/')[-1]
+
+
+def wait_for_rollouts(describe, services, interval=2.0, max_interval=30.0,
+                      timeout=None, report=None):
+    """Poll `services` until each one is stable or has failed.
+
+    `describe` takes a list of service names or ARNs and returns their
+    records (e.g. BotoWrapper.describe_services, 10 per call). Only the
+    services still in progress are polled again. The poll interval
+    starts at `interval` and grows by half, up to `max_interval`, on
+    every tick where nothing changed; it drops back as soon as something
+    does. `report(name, state, message)` is called whenever the state of
+    a service changes.
+
+    Returns {service name: state}; services still in progress when
+    `timeout` (seconds) runs out are left as PROGRESSING.
+    """
+    started = time.time()
+    pending = list(services)
+    states = {}
+    messages = {}
+    delay = interval
+    while True:
+        records = dict((r['serviceName'], r) for r in describe(pending))
+        changed = False
+        for service in pending:
+            name = service_name(service)
+            if name in records:
+                state, message = rollout_state(records[name])
+            else:
+                state, message = FAILED, 'service not found'
+            if (state, message) != (states.get(name), messages.get(name)):
+                changed = True
+                states[name], messages[name] = state, message
+                if report is not None:
+                    report(name, state, message)
+        pending = [s for s in pending
+                   if states[service_name(s)] == PROGRESSING]
+        if not pending:
+            return states
+        elapsed = time.time() - started
+        if timeout is not None and elapsed >= timeout:
+            return states
+        delay = interval if changed else min(max_interval, delay * 1.5)
+        if timeout is not None:
+            delay = min(delay, timeout - elapsed)
+        time.sleep(delay)
@@ -0,0 +1,188 @@
+"""A small, compiled subset of JSONPath for selecting fields of records.
+
+Supported paths look like ``createdAt``, ``$.containers[0].name``,
+``.containers[*].lastStatus`` or ``.tags['aws:cloudformation:stack-name']``.
+Paths are parsed once; evaluating them is a plain loop over the steps.
+"""
+import json
+import re
+from datetime import datetime
+
+
+__all__ = ['SelectorError', 'Selector', 'Template', 'parse_custom_columns',
+           'parse_field_selector', 'format_value', 'format_values']
+
+TOKEN = re.compile(r'''
+    \.?(?P<name>[A-Za-z_][\w-]*)      # .name or a leading bare name
+  | \.\*|\[\*\]                       # wildcard
+  | \[(?P<index>-?\d+)\]              # [0], [-1]
+  | \[(?P<quote>['"])(?P<key>.*?)(?P=quote)\]   # ['some:key']
+''', re.VERBOSE)
+
+KEY, INDEX, WILDCARD = 'key', 'index', 'wildcard'
+
+
+class SelectorError(ValueError):
+    pass
+
+
+def parse_path(expr):
+    path = expr.strip()
+    if path.startswith('{') and path.endswith('}'):
+        path = path[1:-1].strip()
+    if path.startswith('$'):
+        path = path[1:]
+    steps = []
+    pos = 0
+    while pos < len(path):
+        match = TOKEN.match(path, pos)
+        if not match or (steps and match.group('name') and
+                         path[pos] != '.'):
+            raise SelectorError('Invalid path %r at position %d.'
+                                % (expr, pos))
+        if match.group('name') is not None:
+            steps.append((KEY, match.group('name')))
+        elif match.group('index') is not None:
+            steps.append((INDEX, int(match.group('index'))))
+        elif match.group('key') is not None:
+            steps.append((KEY, match.group('key')))
+        else:
+            steps.append((WILDCARD, None))
+        pos = match.end()
+    return steps
+
+
+class Selector:
+    """A compiled path expression."""
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.steps = parse_path(expr)
+        self.keys = [arg for _, arg in self.steps]
+        self.multiple = any(kind == WILDCARD for kind, _ in self.steps)
+
+    def all(self, record):
+        """Return the list of every value the path selects."""
+        if not self.multiple:
+            value = self.first(record)
+            return [] if value is None else [value]
+        values = [record]
+        for kind, arg in self.steps:
+            out = []
+            for value in values:
+                if kind == WILDCARD:
+                    if isinstance(value, dict):
+                        out.extend(value.values())
+                    elif isinstance(value, list):
+                        out.extend(value)
+                    continue
+                try:
+                    out.append(value[arg])
+                except (KeyError, IndexError, TypeError):
+                    pass
+            values = out
+        return values
+
+    def first(self, record):
+        """Return the first value the path selects, or None."""
+        if self.multiple:
+            values = self.all(record)
+            return values[0] if values else None
+        value = record
+        try:
+            for key in self.keys:
+                value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+        return value
+
+    def sort_key(self, record):
+        """A key that sorts records by the selected value, missing last."""
+        value = self.first(record)
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value, sort_keys=True, default=str)
+        return (value is None, value)
+
+
+def format_value(value):
+    if value is None:
+        return '<none>'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+def format_values(values):
+    if not values:
+        return '<none>'
+    return ','.join(format_value(v) for v in values)
+
+
+def parse_custom_columns(spec):
+    """Parse ``NAME:.path,NAME2:.path2`` into (header, Selector) pairs."""
+    columns = []
+    for column in spec.split(','):
+        name, sep, expr = column.partition(':')
+        if not sep or not name or not expr:
+            raise SelectorError('Invalid custom column %r, expected '
+                                'NAME:.path.' % column)
+        columns.append((name, Selector(expr)))
+    return columns
+
+
+def parse_field_selector(spec):
+    """Parse ``path=value,path!=value`` into a predicate on records."""
+    terms = []
+    for term in spec.split(','):
+        match = re.match(r'^(.+?)(==|!=|=)(.*)$', term)
+        if not match:
+            raise SelectorError('Invalid field selector %r, expected '
+                                'path=value or path!=value.' % term)
+        expr, op, expected = match.groups()
+        terms.append((Selector(expr), op == '!=', expected))
+
+    def predicate(record):
+        for selector, negate, expected in terms:
+            values = [format_value(v) for v in selector.all(record)]
+            if (expected in values) == negate:
+                return False
+        return True
+    return predicate
+
+
+class Template:
+    """A ``-o jsonpath=`` template rendered once per record.
+
+    ``{path}`` groups are replaced by the selected values (space
+    separated); text outside the braces is copied with ``\\n`` and
+    ``\\t`` expanded. A template without braces is taken as one path.
+    """
+
+    def __init__(self, template):
+        if '{' not in template:
+            template = '{%s}' % template
+        self.parts = []
+        pos = 0
+        for match in re.finditer(r'\{(.*?)\}', template):
+            self.parts.append(self._literal(template[pos:match.start()]))
+            self.parts.append(Selector(match.group(1)))
+            pos = match.end()
+        self.parts.append(self._literal(template[pos:]))
+
+    @staticmethod
+    def _literal(text):
+        return text.replace('\\n', '\n').replace('\\t', '\t')
+
+    def render(self, record):
+        out = []
+        for part in self.parts:
+            if isinstance(part, Selector):
+                values = part.all(record)
+                out.append(' '.join(format_value(v) for v in values))
+            else:
+                out.append(part)
+        return ''.join(out)
@@ -0,0 +1,178 @@
+import copy
+import shlex
+import threading
+import time
+
+import click
+
+try:
+    read_line = raw_input
+except NameError:  # Python 3
+    read_line = input
+
+
+# Seconds a response stays usable by later commands of a shell session.
+# Operations missing here are never cached; calling one that is not a
+# read (e.g. UpdateService) clears the whole cache.
+DEFAULT_TTLS = {
+    'ListClusters': 300,
+    'DescribeClusters': 30,
+    'ListServices': 60,
+    'DescribeServices': 10,
+    'ListContainerInstances': 30,
+    'DescribeContainerInstances': 10,
+    'ListTasks': 10,
+    'DescribeTasks': 10,
+    'ListTaskDefinitionFamilies': 60,
+    'ListTaskDefinitions': 60,
+    'DescribeTaskDefinition': 60,
+    'DescribeInstances': 300,
+}
+
+READ_PREFIXES = ('Describe', 'List', 'Get')
+
+BUILTINS = '''Shell commands:
+  help     Show this message and the ecsctl commands.
+  refresh  Forget every cached response.
+  exit     Leave the shell (or press Ctrl-D).
+'''
+
+
+class Entry:
+    __slots__ = ('command', 'at', 'http_response', 'parsed')
+
+    def __init__(self, command, at, http_response, parsed):
+        self.command = command
+        self.at = at
+        self.http_response = http_response
+        self.parsed = parsed
+
+
+class ResponseCache:
+    """In-memory cache of read-only API responses, shared by the commands
+    of one `ecsctl shell` session.
+
+    Register it on every boto3 client of the BotoWrapper. A response is
+    only served to later commands, never to the one that fetched it, so
+    commands that poll (rollout status, --watch, drain --wait) always
+    see fresh data.
+    """
+
+    def __init__(self, ttls=None):
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.entries = {}
+        self.command = 0
+        self.lock = threading.Lock()
+
+    def next_command(self):
+        with self.lock:
+            self.command += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def register(self, client):
+        events = client.meta.events
+        service = client.meta.service_model.service_id.hyphenize()
+        events.register('before-call.%s' % service, self._before_call)
+        events.register('after-call.%s' % service, self._after_call)
+
+    @staticmethod
+    def _key(model, params):
+        return (model.service_model.service_name, model.name,
+                params.get('url_path'), repr(params.get('query_string')),
+                repr(params.get('body')))
+
+    def _before_call(self, model=None, params=None, context=None, **kwargs):
+        ttl = self.ttls.get(model.name)
+        if ttl is None or context is None:
+            return None
+        key = self._key(model, params)
+        context['ecsctl_cache_key'] = key
+        with self.lock:
+            entry = self.entries.get(key)
+            if (entry is None or entry.command == self.command or
+                    time.time() - entry.at > ttl):
+                return None
+        context['ecsctl_cache_hit'] = True
+        return entry.http_response, copy.deepcopy(entry.parsed)
+
+    def _after_call(self, model=None, context=None, http_response=None,
+                    parsed=None, **kwargs):
+        context = context or {}
+        if model.name not in self.ttls:
+            if not model.name.startswith(READ_PREFIXES):
+                self.clear()
+            return
+        key = context.get('ecsctl_cache_key')
+        if key is None or context.get('ecsctl_cache_hit'):
+            return
+        if http_response is None or http_response.status_code >= 400:
+            return
+        entry = Entry(self.command, time.time(), http_response,
+                      copy.deepcopy(parsed))
+        with self.lock:
+            self.entries[key] = entry
+
+
+def run_command(cli, obj, args):
+    try:
+        cli.main(args, obj=dict(obj), prog_name='ecsctl',
+                 standalone_mode=False)
+    except click.ClickException as e:
+        e.show()
+    except click.Abort:
+        click.echo('Aborted!', err=True)
+    except Exception as e:
+        click.echo('Error: %s' % e, err=True)
+
+
+def run_shell(cli, obj):
+    """Read ecsctl commands from the terminal until EOF or `exit`.
+
+    Every command runs through `cli` with `obj`, so it reuses the
+    BotoWrapper (clients, connection pools, credentials and caches) of
+    the session.
+    """
+    try:
+        import readline  # noqa: F401 -- line editing and history for input
+    except ImportError:
+        pass
+    bw = obj['bw']
+    responses = bw.response_cache
+    # Resolve credentials and create the clients before the first prompt.
+    bw.ecs_client
+    bw.ec2_client
+    while True:
+        try:
+            line = read_line('ecsctl> ')
+        except EOFError:
+            click.echo()
+            return
+        except KeyboardInterrupt:
+            click.echo()
+            continue
+        try:
+            args = shlex.split(line)
+        except ValueError as e:
+            click.echo('Error: %s' % e, err=True)
+            continue
+        if not args:
+            continue
+        if args[0] in ('exit', 'quit'):
+            return
+        if args[0] == 'refresh':
+            if responses is not None:
+                responses.clear()
+            continue
+        if args[0] == 'help':
+            click.echo(BUILTINS)
+            args = ['--help']
+        if args[0] == 'shell':
+            click.echo('Already in a shell.', err=True)
+            continue
+        if responses is not None:
+            responses.next_command()
+        run_command(cli, obj, args)
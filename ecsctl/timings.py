@@ -0,0 +1,197 @@
+import json
+import threading
+import time
+from collections import defaultdict
+
+
+# The earliest point ecsctl can observe; interpreter startup before the
+# package is imported is not included.
+STARTED = time.time()
+
+DOCKER_CALLS = frozenset([
+    'containers',
+    'exec_create',
+    'exec_inspect',
+    'exec_resize',
+    'exec_start',
+    'logs',
+])
+
+_recorder = None
+
+
+def get_recorder():
+    return _recorder
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted `values`."""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, int(round(p * len(values))) - 1))
+    return values[rank]
+
+
+class Operation:
+    def __init__(self):
+        self.intervals = []
+        self.retries = 0
+        self.bytes = 0
+
+
+class Timings:
+    """Collects the latency of every AWS and Docker call of a command.
+
+    AWS calls are timed from botocore's before-call to after-call event,
+    so the latency includes client-side pacing and retries.
+    """
+
+    def __init__(self):
+        self.operations = defaultdict(Operation)
+        self.command_started = None
+        self.lock = threading.Lock()
+
+    def activate(self):
+        global _recorder
+        _recorder = self
+        self.command_started = time.time()
+
+    def record(self, name, start, end, retries=0, size=0):
+        with self.lock:
+            operation = self.operations[name]
+            operation.intervals.append((start, end))
+            operation.retries += retries
+            operation.bytes += size
+
+    def register(self, client):
+        events = client.meta.events
+        # More specific event names run first; register on the service's
+        # own event so the timer starts before any other handler.
+        service = client.meta.service_model.service_id.hyphenize()
+        events.register_first('before-call.%s' % service, self._before_call)
+        events.register('after-call', self._after_call)
+        events.register('after-call-error', self._after_call_error)
+
+    def _before_call(self, model=None, context=None, **kwargs):
+        if context is not None:
+            context['ecsctl_started'] = time.time()
+            # after-call-error is emitted without the operation model.
+            context['ecsctl_operation'] = self._name(model)
+
+    def _name(self, model):
+        return '%s.%s' % (model.service_model.service_name, model.name)
+
+    def _after_call(self, model=None, context=None, http_response=None,
+                    parsed=None, **kwargs):
+        context = context or {}
+        started = context.get('ecsctl_started')
+        # Responses served by the `ecsctl shell` cache made no call.
+        if started is None or context.get('ecsctl_cache_hit'):
+            return
+        metadata = (parsed or {}).get('ResponseMetadata', {})
+        size = 0
+        if http_response is not None:
+            length = http_response.headers.get('content-length')
+            size = int(length) if length else len(http_response.content)
+        self.record(self._name(model), started, time.time(),
+                    retries=metadata.get('RetryAttempts', 0), size=size)
+
+    def _after_call_error(self, context=None, **kwargs):
+        context = context or {}
+        started = context.get('ecsctl_started')
+        if started is not None:
+            self.record(context['ecsctl_operation'], started, time.time())
+
+    def wrap_docker(self, client):
+        return TimedDockerClient(client, self)
+
+    def busy_time(self, prefix):
+        """Wall time during which at least one matching call was running."""
+        with self.lock:
+            intervals = sorted(
+                interval
+                for name, operation in self.operations.items()
+                if name.startswith(prefix)
+                for interval in operation.intervals
+            )
+        total = 0.0
+        current_start = current_end = None
+        for start, end in intervals:
+            if current_end is None or start > current_end:
+                if current_end is not None:
+                    total += current_end - current_start
+                current_start, current_end = start, end
+            else:
+                current_end = max(current_end, end)
+        if current_end is not None:
+            total += current_end - current_start
+        return total
+
+    def summary(self):
+        now = time.time()
+        total = now - STARTED
+        command_started = self.command_started or now
+        startup = command_started - STARTED
+        api = self.busy_time('ecs.') + self.busy_time('ec2.')
+        docker = self.busy_time('docker.')
+        operations = {}
+        for name, operation in sorted(self.operations.items()):
+            latencies = sorted(end - start
+                               for start, end in operation.intervals)
+            operations[name] = {
+                'count': len(latencies),
+                'p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+                'max_ms': round(latencies[-1] * 1000, 1),
+                'retries': operation.retries,
+                'bytes': operation.bytes,
+            }
+        return {
+            'total_s': round(total, 3),
+            'startup_s': round(startup, 3),
+            'api_s': round(api, 3),
+            'docker_s': round(docker, 3),
+            'local_s': round(max(0.0, total - startup - api - docker), 3),
+            'operations': operations,
+        }
+
+    def report(self, fmt='text'):
+        summary = self.summary()
+        if fmt == 'json':
+            return json.dumps(summary, sort_keys=True)
+        lines = ['%-40s %6s %9s %9s %9s %7s %10s' % (
+            'OPERATION', 'COUNT', 'P50 MS', 'P95 MS', 'MAX MS', 'RETRIES',
+            'BYTES')]
+        for name, op in summary['operations'].items():
+            lines.append('%-40s %6d %9.1f %9.1f %9.1f %7d %10d' % (
+                name, op['count'], op['p50_ms'], op['p95_ms'],
+                op['max_ms'], op['retries'], op['bytes']))
+        lines.append('')
+        lines.append('total %.3fs = startup %.3fs + api %.3fs + docker %.3fs '
+                     '+ local %.3fs' % (summary['total_s'],
+                                        summary['startup_s'],
+                                        summary['api_s'],
+                                        summary['docker_s'],
+                                        summary['local_s']))
+        return '\n'.join(lines)
+
+
+class TimedDockerClient:
+    """Proxy to a docker.APIClient that times the calls in DOCKER_CALLS."""
+
+    def __init__(self, client, timings):
+        self._client = client
+        self._timings = timings
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name not in DOCKER_CALLS:
+            return attr
+
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self._timings.record('docker.%s' % name, start, time.time())
+        return timed
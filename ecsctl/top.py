@@ -0,0 +1,172 @@
+"""Reserved CPU, memory and ports of nodes and services (`ecsctl top`).
+
+Records are reduced to a few integers as they are fetched and kept one
+array per column, so the describe results themselves are never held and
+sums, ratios and sorting work on flat machine-sized values.
+"""
+import array
+import operator
+
+
+PORT_RESOURCES = ('PORTS', 'PORTS_UDP')
+
+OPERATORS = [
+    ('>=', operator.ge),
+    ('<=', operator.le),
+    ('>', operator.gt),
+    ('<', operator.lt),
+    ('=', operator.eq),
+]
+
+
+def parse_thresholds(specs, columns):
+    """Parse ``cpu>=80`` style expressions into (column, op, value)."""
+    thresholds = []
+    for spec in specs:
+        for symbol, op in OPERATORS:
+            column, sep, value = spec.partition(symbol)
+            if sep:
+                break
+        column = column.strip().lower()
+        try:
+            value = float(value)
+        except ValueError:
+            sep = ''
+        if not sep or column not in columns:
+            raise ValueError('Invalid threshold %r, expected COLUMN>=N '
+                             '(or >, <=, <, =) with COLUMN one of %s.'
+                             % (spec, ', '.join(columns)))
+        thresholds.append((column, op, value))
+    return thresholds
+
+
+def units(value):
+    """CPU units or MiB given as an int or a numeric string."""
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def container_memory(container):
+    """MiB reserved by a container: its soft limit, else its hard one."""
+    return units(container.get('memoryReservation') or
+                 container.get('memory'))
+
+
+def resource(resources, name):
+    """The value of a resource; the number of ports for port sets."""
+    for r in resources:
+        if r['name'] != name:
+            continue
+        if r['type'] == 'STRINGSET':
+            return len(r.get('stringSetValue', []))
+        if r['type'] == 'LONG':
+            return r.get('longValue', 0)
+        if r['type'] == 'DOUBLE':
+            return int(r.get('doubleValue', 0))
+        return r.get('integerValue', 0)
+    return 0
+
+
+def node_usage(node):
+    """Return (tasks, cpu, cpu registered, memory, memory registered,
+    ports) of a container instance, as reserved by its tasks.
+
+    The remaining ports of a node include the ones it registered (such
+    as 22), which are not counted.
+    """
+    registered = node.get('registeredResources', [])
+    remaining = node.get('remainingResources', [])
+    cpu = resource(registered, 'CPU')
+    memory = resource(registered, 'MEMORY')
+    ports = sum(resource(remaining, name) - resource(registered, name)
+                for name in PORT_RESOURCES)
+    tasks = node['runningTasksCount'] + node['pendingTasksCount']
+    return (tasks, cpu - resource(remaining, 'CPU'), cpu,
+            memory - resource(remaining, 'MEMORY'), memory, ports)
+
+
+def task_usage(task):
+    """Return (cpu, memory, ports) reserved by a task.
+
+    Without a task level size, the container reservations add up.
+    """
+    containers = task.get('containers', [])
+    cpu = task.get('cpu')
+    if cpu is None:
+        cpu = sum(units(c.get('cpu')) for c in containers)
+    memory = task.get('memory')
+    if memory is None:
+        memory = sum(container_memory(c) for c in containers)
+    ports = sum(len(c.get('networkBindings', [])) for c in containers)
+    return units(cpu), units(memory), ports
+
+
+class Columns:
+    """Rows of a label and integer values, stored one array per column."""
+
+    def __init__(self, names):
+        self.names = names
+        self.labels = []
+        self.data = dict((name, array.array('l')) for name in names)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, name):
+        return self.data[name]
+
+    def append(self, label, values):
+        self.labels.append(label)
+        for name, value in zip(self.names, values):
+            self.data[name].append(value)
+
+    def ratio(self, used, total):
+        """Per row percentage of two columns (NaN where total is 0)."""
+        return array.array('d', (100.0 * u / t if t else float('nan')
+                                 for u, t in zip(self[used], self[total])))
+
+    def group_by(self, key):
+        """Sum the rows by key(label) into a new Columns with a count."""
+        grouped = Columns(['count'] + self.names)
+        index = {}
+        codes = array.array('l')
+        for label in self.labels:
+            group = key(label)
+            code = index.get(group)
+            if code is None:
+                code = index[group] = len(grouped.labels)
+                grouped.labels.append(group)
+            codes.append(code)
+        size = len(grouped.labels)
+        counts = grouped['count']
+        counts.extend([0] * size)
+        for code in codes:
+            counts[code] += 1
+        for name in self.names:
+            sums = grouped[name]
+            sums.extend([0] * size)
+            for code, value in zip(codes, self[name]):
+                sums[code] += value
+        return grouped
+
+
+def select(size, keys, thresholds, sort_by=None, reverse=True):
+    """Return the row numbers passing every threshold, sorted by a key.
+
+    `keys` maps column names to per row values (arrays, or anything
+    indexable); NaN never passes a threshold and sorts last.
+    """
+    rows = range(size)
+    for column, op, value in thresholds:
+        values = keys[column]
+        rows = [i for i in rows if op(values[i], value)]
+    rows = list(rows)
+    if sort_by is not None:
+        values = keys[sort_by]
+        # NaN compares false with everything, so it is keyed separately.
+        rows.sort(key=lambda i: (values[i] == values[i],
+                                 values[i] if values[i] == values[i] else 0),
+                  reverse=reverse)
+    return rows
@@ -0,0 +1,74 @@
+import time
+
+
+def task_is_settled(task):
+    return task['lastStatus'] == task['desiredStatus']
+
+
+def task_is_terminal(task):
+    return task['lastStatus'] == 'STOPPED'
+
+
+def service_is_settled(service):
+    # list_services gives no hint that a service was updated, so every
+    # live service has to be described again on each tick.
+    return service_is_terminal(service)
+
+
+def service_is_terminal(service):
+    return service['status'] == 'INACTIVE'
+
+
+class Snapshot:
+    """The last known state of a listing, refreshed incrementally.
+
+    Each refresh lists the ARNs again but only describes the ones that
+    are new, the ones whose state is still in transition, and the ones
+    that dropped out of the listing (once, to learn how they ended).
+    Records that reach a terminal state after leaving the listing are
+    forgotten.
+    """
+
+    def __init__(self, list_arns, describe, arn_key, is_settled, is_terminal):
+        self.list_arns = list_arns
+        self.describe = describe
+        self.arn_key = arn_key
+        self.is_settled = is_settled
+        self.is_terminal = is_terminal
+        self.records = {}
+        self.order = []
+
+    def refresh(self):
+        """Refresh the snapshot and return the records that changed."""
+        listed = list(self.list_arns())
+        current = set(listed)
+        gone = [arn for arn in self.order if arn not in current]
+        stale = [arn for arn in listed
+                 if arn not in self.records or
+                 not self.is_settled(self.records[arn])]
+        changed = []
+        seen = set()
+        for record in self.describe(stale + gone):
+            arn = record[self.arn_key]
+            seen.add(arn)
+            if self.records.get(arn) != record:
+                changed.append(record)
+            self.records[arn] = record
+        for arn in gone:
+            record = self.records.get(arn)
+            if arn not in seen or self.is_terminal(record):
+                del self.records[arn]
+        self.order = listed + [arn for arn in gone if arn in self.records]
+        return changed
+
+    def __iter__(self):
+        return (self.records[arn] for arn in self.order)
+
+
+def watch(snapshot, interval):
+    """Yield the full snapshot first, then the changed records per tick."""
+    snapshot.refresh()
+    yield list(snapshot)
+    while True:
+        time.sleep(interval)
+        yield snapshot.refresh()
@@ -1,38 +1,168 @@
 
-import boto3
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .index import TaskDefinitionIndex, parse_task_definition_arn
+
+
+DEFAULT_CONCURRENCY = 8
+
+MAX_ATTEMPTS = 10
+
+# A container instance stays on the same EC2 instance for its lifetime, so
+# its address rarely changes; entries are also dropped when connecting
+# to them fails.
+ADDRESS_TTL = 24 * 60 * 60
+
+
+def chunked(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ordered_map(func, iterable, concurrency=DEFAULT_CONCURRENCY):
+    """Like map(), but runs up to `concurrency` calls at once.
+
+    Results are yielded in input order. The input is consumed lazily, so
+    items can still be produced (e.g. list pages being fetched) while
+    earlier items are being processed.
+    """
+    if concurrency <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= concurrency:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def try_map(func, items, concurrency=DEFAULT_CONCURRENCY):
+    """Run `func` on every item in parallel, like ordered_map().
+
+    Yields (item, result, error) in input order; an exception raised for
+    one item is returned as its error instead of stopping the others.
+    """
+    def call(item):
+        try:
+            return item, func(item), None
+        except Exception as e:
+            return item, None, e
+    return ordered_map(call, items, concurrency)
+
+
+def is_task_definition_revision(task_definition):
+    """Whether the reference names one (immutable) revision.
+
+    Both full ARNs and `family:revision` qualify; a bare family name
+    resolves to whatever the latest revision is.
+    """
+    name = task_definition.rpartition('/')[-1]
+    family, _, revision = name.rpartition(':')
+    return bool(family) and revision.isdigit()
 
 
 class BotoWrapper:
 
-    def __init__(self, session=None):
-        if not session:
-            session = boto3.session.Session()
-        self.session = session
-        self.ecs_client = session.client('ecs')
-        self.ec2_client = session.client('ec2')
+    def __init__(self, session=None, concurrency=DEFAULT_CONCURRENCY,
+                 cache=None, rate_limiter=None, timings=None, index=None,
+                 response_cache=None):
+        self._session = session
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.concurrency = concurrency
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.timings = timings
+        if index is None:
+            index = TaskDefinitionIndex(':memory:')
+        self.index = index
+        self.response_cache = response_cache
+
+    # boto3 is slow to import and clients are slow to create, so both
+    # are deferred until a command actually talks to AWS.
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                import boto3
+                self._session = boto3.session.Session()
+            return self._session
+
+    def _client(self, service_name):
+        client = self._clients.get(service_name)
+        if client is not None:
+            return client
+        from botocore.config import Config
+        session = self.session
+        with self._lock:
+            if service_name not in self._clients:
+                config = Config(
+                    max_pool_connections=max(10, self.concurrency),
+                    retries={'mode': 'standard',
+                             'max_attempts': MAX_ATTEMPTS},
+                )
+                client = session.client(service_name, config=config)
+                if self.rate_limiter is not None:
+                    self.rate_limiter.register(client)
+                if self.response_cache is not None:
+                    self.response_cache.register(client)
+                if self.timings is not None:
+                    self.timings.register(client)
+                self._clients[service_name] = client
+            return self._clients[service_name]
+
+    @property
+    def ecs_client(self):
+        return self._client('ecs')
+
+    @property
+    def ec2_client(self):
+        return self._client('ec2')
+
+    def _paginate(self, operation, key, **params):
+        paginator = self.ecs_client.get_paginator(operation)
+        for page in paginator.paginate(**params):
+            for item in page[key]:
+                yield item
+
+    def _describe_batches(self, describe, arns, batch_size):
+        batches = chunked(arns, batch_size)
+        for records in ordered_map(describe, batches, self.concurrency):
+            for record in records:
+                yield record
 
     def describe_instance(self, instance_id):
         resp = self.ec2_client.describe_instances(InstanceIds=[instance_id])
         return resp['Reservations'][0]['Instances'][0]
 
     def all_service_arns(self, cluster='default'):
-        paginator = self.ecs_client.get_paginator('list_services')
-        out = []
-        for page in paginator.paginate(cluster=cluster):
-            out += page['serviceArns']
-        return out
+        return self._paginate('list_services', 'serviceArns',
+                              cluster=cluster)
 
-    def get_services(self, cluster='default'):
-        services = self.all_service_arns(cluster=cluster)
-        out = []
-        while services:
-            batch_services, services = services[:10], services[10:]
+    def describe_services(self, services, cluster='default'):
+        def describe(batch_services):
             resp = self.ecs_client.describe_services(
                 cluster=cluster,
                 services=batch_services,
             )
-            out += resp['services']
-        return out
+            return resp['services']
+        return self._describe_batches(describe, services, 10)
+
+    def get_services(self, cluster='default'):
+        services = self.all_service_arns(cluster=cluster)
+        return self.describe_services(services, cluster=cluster)
 
     def describe_service(self, service, cluster='default'):
         resp = self.ecs_client.describe_services(
@@ -43,24 +173,30 @@ class BotoWrapper:
             raise Exception('Service not found.')
         return resp['services'][0]
 
-    def all_container_instance_arns(self, cluster='default'):
-        paginator = self.ecs_client.get_paginator('list_container_instances')
-        out = []
-        for page in paginator.paginate(cluster=cluster):
-            out += page['containerInstanceArns']
-        return out
+    def all_container_instance_arns(self, cluster='default', query=None):
+        """List container instance ARNs.
 
-    def get_container_instances(self, cluster='default'):
-        nodes = self.all_container_instance_arns(cluster=cluster)
-        out = []
-        while nodes:
-            batch_nodes, nodes = nodes[:100], nodes[100:]
+        `query` is a cluster query language expression, such as
+        ``attribute:ecs.ami-id == ami-1``.
+        """
+        params = {'cluster': cluster}
+        if query:
+            params['filter'] = query
+        return self._paginate('list_container_instances',
+                              'containerInstanceArns', **params)
+
+    def describe_container_instances(self, nodes, cluster='default'):
+        def describe(batch_nodes):
             resp = self.ecs_client.describe_container_instances(
                 cluster=cluster,
                 containerInstances=batch_nodes,
             )
-            out += resp['containerInstances']
-        return out
+            return resp['containerInstances']
+        return self._describe_batches(describe, nodes, 100)
+
+    def get_container_instances(self, cluster='default'):
+        nodes = self.all_container_instance_arns(cluster=cluster)
+        return self.describe_container_instances(nodes, cluster=cluster)
 
     def describe_container_instance(self, node, cluster='default'):
         resp = self.ecs_client.describe_container_instances(
@@ -69,20 +205,57 @@ class BotoWrapper:
         )
         return resp['containerInstances'][0]
 
+    def container_instance_address(self, node, cluster='default'):
+        """Return the private IP address of a container instance."""
+        key = 'address:%s' % node
+        if self.cache is not None:
+            address = self.cache.get(key, max_age=ADDRESS_TTL)
+            if address is not None:
+                return address
+        node_info = self.describe_container_instance(node, cluster=cluster)
+        ec2_info = self.describe_instance(node_info['ec2InstanceId'])
+        address = ec2_info['PrivateIpAddress']
+        if self.cache is not None:
+            self.cache.put(key, address)
+        return address
+
+    def forget_container_instance_address(self, node):
+        if self.cache is not None:
+            self.cache.delete('address:%s' % node)
+
     def all_cluster_arns(self):
-        resp = self.ecs_client.list_clusters()
-        return resp['clusterArns']
+        return self._paginate('list_clusters', 'clusterArns')
 
     def get_clusters(self):
-        clusters = self.all_cluster_arns()
-        out = []
-        while clusters:
-            batch_clusters, clusters = clusters[:10], clusters[10:]
+        def describe(batch_clusters):
             resp = self.ecs_client.describe_clusters(
                 clusters=batch_clusters,
             )
-            out += resp['clusters']
-        return out
+            return resp['clusters']
+        clusters = self.all_cluster_arns()
+        return self._describe_batches(describe, clusters, 10)
+
+    def across_clusters(self, method, project=None, **kwargs):
+        """Run a per-cluster listing such as get_tasks on every cluster.
+
+        Up to `concurrency` clusters are queried at once. Yields
+        (cluster name, record) pairs, grouped by cluster in list order.
+        With `project`, records are mapped through it as they are
+        fetched, so only its results are held while other clusters are
+        printed; records it maps to None are left out.
+        """
+        def fetch(cluster_arn):
+            records = method(cluster=cluster_arn, **kwargs)
+            if project is None:
+                return list(records)
+            records = (project(r) for r in records)
+            return [r for r in records if r is not None]
+        clusters = list(self.all_cluster_arns())
+        results = ordered_map(fetch, clusters, self.concurrency)
+        for cluster_arn, records in zip(clusters, results):
+            name = cluster_arn.rpartition('/')[-1]
+            for record in records:
+                yield name, record
 
     def describe_cluster(self, cluster):
         resp = self.ecs_client.describe_clusters(
@@ -119,48 +292,81 @@ class BotoWrapper:
         resp = self.ecs_client.deregister_task_definition(
             taskDefinition=task_definition,
         )
-        return resp['taskDefinition']
-
-    def all_tasks(self, cluster='default'):
-        paginator = self.ecs_client.get_paginator('list_tasks')
-        out = []
-        for page in paginator.paginate(cluster=cluster):
-            out += page['taskArns']
-        return out
-
-    def get_tasks(self, cluster):
-        tasks = self.all_tasks(cluster=cluster)
-        out = []
-        while tasks:
-            batch_tasks, tasks = tasks[:100], tasks[100:]
+        info = resp['taskDefinition']
+        if self.cache is not None:
+            # The status is the one field of a revision that can change.
+            self.cache.put(info['taskDefinitionArn'], info)
+        self.index.remove(self._scope(), [info['taskDefinitionArn']])
+        return info
+
+    def deregister_task_definitions(self, task_definitions):
+        """Deregister revisions in parallel, like try_map()."""
+        return try_map(self.deregister_task_definition, task_definitions,
+                       self.concurrency)
+
+    def task_definitions_in_use(self):
+        """Return the task definition ARNs that any cluster still uses.
+
+        That is the revisions of every deployment of every service and
+        of every task that is not stopped.
+        """
+        def service_revisions(service):
+            arns = [service['taskDefinition']]
+            for deployment in service.get('deployments', []):
+                arns.append(deployment['taskDefinition'])
+            return arns
+        in_use = set()
+        services = self.across_clusters(self.get_services,
+                                        project=service_revisions)
+        for _, arns in services:
+            in_use.update(arns)
+        tasks = self.across_clusters(
+            self.get_tasks, project=lambda t: t['taskDefinitionArn'])
+        for _, arn in tasks:
+            in_use.add(arn)
+        return in_use
+
+    def all_tasks(self, cluster='default', service=None, family=None,
+                  node=None, desired_status=None, launch_type=None):
+        params = dict(cluster=cluster)
+        if service is not None:
+            params['serviceName'] = service
+        if family is not None:
+            params['family'] = family
+        if node is not None:
+            params['containerInstance'] = node
+        if desired_status is not None:
+            params['desiredStatus'] = desired_status
+        if launch_type is not None:
+            params['launchType'] = launch_type
+        return self._paginate('list_tasks', 'taskArns', **params)
+
+    def describe_tasks(self, tasks, cluster='default'):
+        def describe(batch_tasks):
             resp = self.ecs_client.describe_tasks(
                 tasks=batch_tasks,
                 cluster=cluster,
             )
-            out += resp['tasks']
-        return out
+            return resp['tasks']
+        return self._describe_batches(describe, tasks, 100)
+
+    def get_tasks(self, cluster, **filters):
+        tasks = self.all_tasks(cluster=cluster, **filters)
+        return self.describe_tasks(tasks, cluster=cluster)
 
     def all_task_definition_families(self, family_prefix=None, status='ALL'):
-        paginator = self.ecs_client.get_paginator(
-            'list_task_definition_families'
-        )
-        out = []
         params = dict(status=status)
         if family_prefix is not None:
             params['familyPrefix'] = family_prefix
-        for page in paginator.paginate(**params):
-            out += page['families']
-        return out
+        return self._paginate('list_task_definition_families', 'families',
+                              **params)
 
     def all_task_definitions(self, family_prefix=None, status='ALL'):
-        paginator = self.ecs_client.get_paginator('list_task_definitions')
-        out = []
         params = dict(status=status)
         if family_prefix is not None:
             params['familyPrefix'] = family_prefix
-        for page in paginator.paginate(**params):
-            out += page['taskDefinitionArns']
-        return out
+        return self._paginate('list_task_definitions', 'taskDefinitionArns',
+                              **params)
 
     def describe_task(self, task, cluster='default'):
         resp = self.ecs_client.describe_tasks(
@@ -171,11 +377,136 @@ class BotoWrapper:
             raise Exception('Task not found.')
         return resp['tasks'][0]
 
+    def _scope(self):
+        return '%s:%s' % (self.session.profile_name, self.session.region_name)
+
+    def _task_definition_alias(self, task_definition):
+        return 'alias:%s:%s' % (self._scope(), task_definition)
+
+    def _cached_task_definition(self, task_definition):
+        if task_definition.startswith('arn:'):
+            return self.cache.get(task_definition)
+        arn = self.cache.get(self._task_definition_alias(task_definition))
+        if arn is None:
+            return None
+        return self.cache.get(arn)
+
     def describe_task_definition(self, task_definition, cluster='default'):
+        cacheable = (self.cache is not None and
+                     is_task_definition_revision(task_definition))
+        if cacheable:
+            info = self._cached_task_definition(task_definition)
+            if info is not None:
+                return info
         resp = self.ecs_client.describe_task_definition(
             taskDefinition=task_definition,
         )
-        return resp['taskDefinition']
+        info = resp['taskDefinition']
+        if cacheable:
+            arn = info['taskDefinitionArn']
+            self.cache.put(arn, info)
+            if arn != task_definition:
+                alias = self._task_definition_alias(task_definition)
+                self.cache.put(alias, arn)
+        return info
+
+    def _family_revisions(self, family, newer_than=0):
+        """Yield the ACTIVE revisions of `family`, newest first.
+
+        familyPrefix also matches longer family names, which sort first
+        in descending order and are skipped. Paging stops at the first
+        revision that is not newer than `newer_than`.
+        """
+        arns = self._paginate('list_task_definitions', 'taskDefinitionArns',
+                              familyPrefix=family, status='ACTIVE',
+                              sort='DESC')
+        for arn in arns:
+            arn_family, revision = parse_task_definition_arn(arn)
+            if arn_family != family:
+                continue
+            if revision <= newer_than:
+                return
+            yield arn
+
+    def sync_task_definition_family(self, family):
+        """Bring the index up to date for one family.
+
+        Once a family is indexed this usually takes one call: describing
+        the family returns its latest ACTIVE revision, and only when that
+        is newer than the index are the new revisions listed.
+        """
+        scope = self._scope()
+        known = self.index.max_revision(scope, family)
+        if known is None:
+            self.index.add(scope, self._family_revisions(family))
+            return
+        from botocore.exceptions import ClientError
+        try:
+            latest = self.describe_task_definition(family)['revision']
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ClientException':
+                raise
+            # The family has no ACTIVE revision left.
+            self.index.remove_family(scope, family)
+            return
+        if latest < known:
+            self.index.remove_family(scope, family, above=latest)
+        elif latest > known:
+            self.index.add(scope, self._family_revisions(family,
+                                                         newer_than=known))
+
+    def sync_task_definitions(self, full=False):
+        """Bring the index up to date for every family.
+
+        The first sync (or a `full` one) lists every ACTIVE revision.
+        While the index is fresh (see TaskDefinitionIndex.ttl) nothing is
+        called. After that the families are listed and, unless listing
+        every revision again takes fewer calls (100 revisions per page
+        against one call per family), each of them is synced in
+        parallel, which only lists the revisions registered since.
+        Revisions deregistered outside ecsctl, other than the latest
+        ones of a family, are only noticed by a full sync.
+        """
+        scope = self._scope()
+        if not full and self.index.is_synced(scope):
+            if self.index.is_fresh(scope):
+                return
+            families = set(self.all_task_definition_families(
+                status='ACTIVE'))
+            if len(families) * 100 < self.index.count(scope):
+                for family in self.index.families(scope):
+                    if family not in families:
+                        self.index.remove_family(scope, family)
+                syncs = ordered_map(self.sync_task_definition_family,
+                                    sorted(families), self.concurrency)
+                for _ in syncs:
+                    pass
+                self.index.mark_synced(scope)
+                return
+        arns = self._paginate('list_task_definitions', 'taskDefinitionArns',
+                              status='ACTIVE')
+        self.index.replace(scope, arns)
+
+    def indexed_task_definitions(self, family=None, family_prefix=None,
+                                 revisions=None, full_sync=False):
+        """Yield ACTIVE task definition ARNs from the synced index.
+
+        Families are in name order, each with its newest `revisions`
+        (default all) revisions first. With `family`, only that family is
+        synced (unless the index is fresh and knows it) and listed.
+        """
+        scope = self._scope()
+        if family is not None:
+            if (full_sync or not self.index.is_fresh(scope) or
+                    self.index.max_revision(scope, family) is None):
+                self.sync_task_definition_family(family)
+            families = [family]
+        else:
+            self.sync_task_definitions(full=full_sync)
+            families = self.index.families(scope, family_prefix)
+        for name in families:
+            for arn in self.index.revisions(scope, name, limit=revisions):
+                yield arn
 
     def run(self, name=None, cluster='default', command=(),
             image=None, cpu=1024, memory=2048, count=1):
@@ -195,6 +526,12 @@ class BotoWrapper:
             containerDefinitions=[container_definition],
         )
         task_def_arn = resp['taskDefinition']['taskDefinitionArn']
+        # Only the revision right after the newest indexed one is added;
+        # otherwise it would hide the revisions the index does not know.
+        scope = self._scope()
+        known = self.index.max_revision(scope, task_def_family)
+        if known == resp['taskDefinition']['revision'] - 1:
+            self.index.add(scope, [task_def_arn])
         resp = self.ecs_client.create_service(
             cluster=cluster,
             serviceName=service_name,
@@ -209,21 +546,39 @@ class BotoWrapper:
         )
         return resp
 
-    def drain_node(self, node, cluster='default'):
-        resp = self.ecs_client.update_container_instances_state(
-            cluster=cluster,
-            containerInstances=[node],
-            status='DRAINING',
-        )
-        return resp
+    def stop_tasks(self, tasks, cluster='default',
+                   reason='Stopped with ecsctl.'):
+        """Stop many tasks in parallel; yields (task, response, error)."""
+        def stop(task):
+            return self.stop_task(task, cluster=cluster, reason=reason)
+        return try_map(stop, tasks, self.concurrency)
 
-    def undrain_node(self, node, cluster='default'):
-        resp = self.ecs_client.update_container_instances_state(
-            cluster=cluster,
-            containerInstances=[node],
-            status='ACTIVE',
-        )
-        return resp
+    def update_container_instances_state(self, nodes, status,
+                                         cluster='default'):
+        """Set the status of container instances, 10 per call.
+
+        Returns the updated container instances and the failures.
+        """
+        def update(batch_nodes):
+            return self.ecs_client.update_container_instances_state(
+                cluster=cluster,
+                containerInstances=batch_nodes,
+                status=status,
+            )
+        updated, failures = [], []
+        batches = chunked(nodes, 10)
+        for resp in ordered_map(update, batches, self.concurrency):
+            updated.extend(resp['containerInstances'])
+            failures.extend(resp['failures'])
+        return updated, failures
+
+    def drain_nodes(self, nodes, cluster='default'):
+        return self.update_container_instances_state(nodes, 'DRAINING',
+                                                     cluster=cluster)
+
+    def undrain_nodes(self, nodes, cluster='default'):
+        return self.update_container_instances_state(nodes, 'ACTIVE',
+                                                     cluster=cluster)
 
     def scale_service(self, service, count, cluster='default'):
         resp = self.ecs_client.update_service(
@@ -233,6 +588,12 @@ class BotoWrapper:
         )
         return resp
 
+    def scale_services(self, services, count, cluster='default'):
+        """Scale many services in parallel; yields (service, resp, error)."""
+        def scale(service):
+            return self.scale_service(service, count, cluster=cluster)
+        return try_map(scale, services, self.concurrency)
+
     def strip_task_def_data(self, info):
         info = info.copy()
         del info['status']
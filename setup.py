@@ -3,15 +3,16 @@
 from setuptools import setup
 
 install_requires = [
-    'boto3>=1.4.5',
+    'boto3>=1.12.0',
     'click>=6.7',
     'configparser>=3.5.0',
     'docker>=2.4.2',
     'dockerpty>=0.4.1',
-    'jsonpath>=0.75',
     'tabulate>=0.7.7',
     'humanize>=0.5.1',
     'pytz>=2017.2',
+    'python-dateutil>=2.1',
+    'futures>=3.0; python_version < "3"',
 ]
 
 classifiers = [
@@ -0,0 +1,69 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from dateutil.tz import tzutc
+
+from ecsctl import cache
+from ecsctl.cache import DiskCache, encode
+
+
+class FakeTime:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+class DiskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache', 'cache.sqlite')
+        self.saved = cache.time
+        cache.time = FakeTime()
+
+    def tearDown(self):
+        cache.time = self.saved
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        c = DiskCache(self.path)
+        value = {'revision': 3, 'registeredAt':
+                 datetime.datetime(2020, 1, 2, tzinfo=tzutc())}
+        c.put('a', value)
+        self.assertEqual(c.get('a'), value)
+        self.assertIsNone(c.get('b'))
+        c.delete('a')
+        self.assertIsNone(c.get('a'))
+
+    def test_max_age(self):
+        c = DiskCache(self.path)
+        c.put('a', 1)
+        self.assertEqual(c.get('a', max_age=10), 1)
+        cache.time.now += 60
+        self.assertIsNone(c.get('a', max_age=10))
+
+    def test_evicts_least_recently_used(self):
+        size = len(encode('x' * 100))
+        c = DiskCache(self.path, max_bytes=size * 2)
+        c.put('a', 'x' * 100)
+        c.put('b', 'x' * 100)
+        self.assertEqual(c.get('a'), 'x' * 100)
+        c.put('c', 'x' * 100)
+        self.assertIsNone(c.get('b'))
+        self.assertEqual(c.get('a'), 'x' * 100)
+        self.assertEqual(c.get('c'), 'x' * 100)
+
+    def test_shared_between_instances(self):
+        DiskCache(self.path).put('a', [1, 2])
+        self.assertEqual(DiskCache(self.path).get('a'), [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import unittest
+
+from ecsctl import index
+from ecsctl.index import TaskDefinitionIndex, parse_task_definition_arn
+from ecsctl.wrapboto import BotoWrapper
+
+
+SCOPE = 'default:us-east-1'
+
+
+def arn(family, revision):
+    return ('arn:aws:ecs:us-east-1:1:task-definition/%s:%d'
+            % (family, revision))
+
+
+class FakeTime:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class TaskDefinitionIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = TaskDefinitionIndex(':memory:')
+
+    def test_parse_arn(self):
+        self.assertEqual(parse_task_definition_arn(arn('web-app', 12)),
+                         ('web-app', 12))
+
+    def test_revisions_newest_first(self):
+        self.index.add(SCOPE, [arn('web', 1), arn('web', 3), arn('web', 2),
+                               arn('worker', 1)])
+        self.index.add('other:eu-west-1', [arn('api', 1)])
+        self.assertEqual(self.index.families(SCOPE), ['web', 'worker'])
+        self.assertEqual(self.index.families(SCOPE, 'wor'), ['worker'])
+        self.assertEqual(self.index.revisions(SCOPE, 'web'),
+                         [arn('web', 3), arn('web', 2), arn('web', 1)])
+        self.assertEqual(self.index.revisions(SCOPE, 'web', limit=1),
+                         [arn('web', 3)])
+        self.assertEqual(self.index.max_revision(SCOPE, 'web'), 3)
+        self.assertIsNone(self.index.max_revision(SCOPE, 'api'))
+        self.assertEqual(self.index.count(SCOPE), 4)
+
+    def test_remove(self):
+        self.index.add(SCOPE, [arn('web', r) for r in range(1, 6)])
+        self.index.remove(SCOPE, [arn('web', 1)])
+        self.index.remove_family(SCOPE, 'web', above=3)
+        self.assertEqual(self.index.revisions(SCOPE, 'web'),
+                         [arn('web', 3), arn('web', 2)])
+
+    def test_replace_marks_the_scope_synced(self):
+        saved = index.time
+        index.time = fake = FakeTime()
+        try:
+            self.index.add(SCOPE, [arn('old', 1)])
+            self.assertFalse(self.index.is_synced(SCOPE))
+            self.index.replace(SCOPE, [arn('web', 1)])
+            self.assertEqual(self.index.families(SCOPE), ['web'])
+            self.assertTrue(self.index.is_fresh(SCOPE))
+            fake.now += self.index.ttl
+            self.assertTrue(self.index.is_synced(SCOPE))
+            self.assertFalse(self.index.is_fresh(SCOPE))
+        finally:
+            index.time = saved
+
+
+class FakeWrapper(BotoWrapper):
+    """Serves task definitions from a dict of {family: [revisions]}."""
+
+    def __init__(self, revisions, ttl=0):
+        BotoWrapper.__init__(self, concurrency=1,
+                             index=TaskDefinitionIndex(':memory:', ttl=ttl))
+        self.revisions = revisions
+        self.calls = []
+
+    def _scope(self):
+        return SCOPE
+
+    def _paginate(self, operation, key, **params):
+        self.calls.append(operation)
+        if operation == 'list_task_definition_families':
+            return sorted(f for f, r in self.revisions.items() if r)
+        arns = [arn(f, r) for f in sorted(self.revisions)
+                for r in self.revisions[f]
+                if f.startswith(params.get('familyPrefix', ''))]
+        if params.get('sort') == 'DESC':
+            arns.reverse()
+        return arns
+
+    def describe_task_definition(self, family, cluster='default'):
+        self.calls.append('describe_task_definition')
+        return {'revision': max(self.revisions[family])}
+
+
+class SyncTest(unittest.TestCase):
+
+    def test_few_revisions_per_family_are_relisted(self):
+        bw = FakeWrapper({'web': [1, 2], 'worker': [1]})
+        list(bw.indexed_task_definitions())
+        bw.revisions['web'].append(3)
+        bw.calls = []
+        arns = list(bw.indexed_task_definitions(revisions=1))
+        self.assertEqual(arns, [arn('web', 3), arn('worker', 1)])
+        self.assertEqual(bw.calls, ['list_task_definition_families',
+                                    'list_task_definitions'])
+
+    def test_many_revisions_per_family_sync_each_family(self):
+        bw = FakeWrapper({'web': list(range(1, 300)), 'worker': [1]})
+        list(bw.indexed_task_definitions())
+        bw.revisions['web'].append(300)
+        bw.revisions['worker'] = []
+        bw.calls = []
+        arns = list(bw.indexed_task_definitions(revisions=2))
+        self.assertEqual(arns, [arn('web', 300), arn('web', 299)])
+        self.assertEqual(bw.calls, ['list_task_definition_families',
+                                    'describe_task_definition',
+                                    'list_task_definitions'])
+
+    def test_fresh_index_makes_no_calls(self):
+        bw = FakeWrapper({'web': [1, 2]}, ttl=300)
+        list(bw.indexed_task_definitions())
+        bw.calls = []
+        self.assertEqual(list(bw.indexed_task_definitions(revisions=1)),
+                         [arn('web', 2)])
+        self.assertEqual(list(bw.indexed_task_definitions(family='web')),
+                         [arn('web', 2), arn('web', 1)])
+        self.assertEqual(bw.calls, [])
+
+    def test_family_lookup_lists_new_revisions_only(self):
+        bw = FakeWrapper({'web': [1, 2], 'web-admin': [7]})
+        self.assertEqual(list(bw.indexed_task_definitions(family='web')),
+                         [arn('web', 2), arn('web', 1)])
+        bw.revisions['web'].append(3)
+        bw.calls = []
+        self.assertEqual(list(bw.indexed_task_definitions(family='web',
+                                                          revisions=1)),
+                         [arn('web', 3)])
+        self.assertEqual(bw.calls, ['describe_task_definition',
+                                    'list_task_definitions'])
+
+
+if __name__ == '__main__':
+    unittest.main()
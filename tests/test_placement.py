@@ -0,0 +1,105 @@
+import unittest
+
+from ecsctl.placement import AZ_FIELD, Demand, Node, shortage, simulate
+
+
+def node(name, cpu=1024, memory=2048, ports=(), zone='a'):
+    return Node({
+        'containerInstanceArn': 'arn:%s' % name,
+        'ec2InstanceId': name,
+        'remainingResources': [
+            {'name': 'CPU', 'type': 'INTEGER', 'integerValue': cpu},
+            {'name': 'MEMORY', 'type': 'INTEGER', 'integerValue': memory},
+            {'name': 'PORTS', 'type': 'STRINGSET',
+             'stringSetValue': [str(p) for p in ports]},
+        ],
+        'attributes': [{'name': 'ecs.availability-zone', 'value': zone}],
+    })
+
+
+def placed(placement):
+    return dict((n.name, count) for n, count in placement.nodes.items())
+
+
+BINPACK_MEMORY = [{'type': 'binpack', 'field': 'memory'}]
+SPREAD_INSTANCES = [{'type': 'spread', 'field': 'instanceId'}]
+
+
+class DemandTest(unittest.TestCase):
+
+    def test_from_task_definition(self):
+        demand = Demand.from_task_definition({
+            'containerDefinitions': [
+                {'cpu': 256, 'memoryReservation': 128, 'memory': 512,
+                 'portMappings': [{'containerPort': 80, 'hostPort': 8080}]},
+                {'cpu': 128, 'memory': 256,
+                 'portMappings': [{'containerPort': 53, 'hostPort': 0,
+                                   'protocol': 'udp'}]},
+            ],
+        })
+        self.assertEqual((demand.cpu, demand.memory), (384, 384))
+        self.assertEqual(demand.ports, frozenset([('tcp', 8080)]))
+
+    def test_task_size_and_host_mode(self):
+        demand = Demand.from_task_definition({
+            'cpu': '512', 'memory': '1024', 'networkMode': 'host',
+            'containerDefinitions': [
+                {'portMappings': [{'containerPort': 80}]},
+            ],
+        })
+        self.assertEqual((demand.cpu, demand.memory), (512, 1024))
+        self.assertEqual(demand.ports, frozenset([('tcp', 80)]))
+
+
+class SimulateTest(unittest.TestCase):
+
+    def test_binpack_fills_the_fullest_node_first(self):
+        nodes = [node('i-1', memory=2048), node('i-2', memory=1024)]
+        placement = simulate(nodes, Demand(memory=512), 3,
+                             strategy=BINPACK_MEMORY)
+        self.assertEqual(placed(placement), {'i-2': 2, 'i-1': 1})
+        self.assertEqual(nodes[1].memory, 0)
+
+    def test_spread_over_instances(self):
+        nodes = [node('i-%d' % i) for i in range(3)]
+        nodes[0].tasks = 1
+        placement = simulate(nodes, Demand(cpu=10), 5,
+                             strategy=SPREAD_INSTANCES)
+        self.assertEqual(placed(placement), {'i-1': 2, 'i-2': 2, 'i-0': 1})
+
+    def test_default_strategy_spreads_over_zones(self):
+        nodes = [node('i-1', zone='a'), node('i-2', zone='a'),
+                 node('i-3', zone='b')]
+        placement = simulate(nodes, Demand(cpu=10), 4)
+        self.assertEqual(placement.by_attribute(AZ_FIELD),
+                         {'a': 2, 'b': 2})
+        self.assertEqual(placed(placement), {'i-1': 1, 'i-2': 1, 'i-3': 2})
+
+    def test_distinct_instance(self):
+        nodes = [node('i-1'), node('i-2')]
+        placement = simulate(nodes, Demand(cpu=10), 3, distinct=True)
+        self.assertEqual(placement.placed, 2)
+        self.assertEqual(placement.reasons, {'distinctInstance': 2})
+
+    def test_port_conflicts(self):
+        nodes = [node('i-1', ports=[22, 80]), node('i-2', ports=[22])]
+        placement = simulate(nodes, Demand(ports=[('tcp', 80)]), 2)
+        self.assertEqual(placed(placement), {'i-2': 1})
+        self.assertEqual(placement.reasons, {'ports': 2})
+
+    def test_shortage(self):
+        small = node('i-1', cpu=100, memory=100)
+        self.assertEqual(shortage(small, Demand(cpu=200)), 'cpu')
+        self.assertEqual(shortage(small, Demand(memory=200)), 'memory')
+        self.assertIsNone(shortage(small, Demand(cpu=100, memory=100)))
+
+    def test_stops_when_nothing_fits(self):
+        nodes = [node('i-1', cpu=1024), node('i-2', cpu=512)]
+        placement = simulate(nodes, Demand(cpu=512), 5,
+                             strategy=SPREAD_INSTANCES)
+        self.assertEqual(placement.placed, 3)
+        self.assertEqual(placement.reasons, {'cpu': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+
+from ecsctl import ratelimit
+from ecsctl.ratelimit import RateLimiter, TokenBucket, parse_rates
+
+
+class FakeTime:
+    """Stands in for the clock and time.sleep of the ratelimit module."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeTime()
+        self.saved = ratelimit.clock, ratelimit.time
+        ratelimit.clock = self.fake.clock
+        ratelimit.time = self.fake
+
+    def tearDown(self):
+        ratelimit.clock, ratelimit.time = self.saved
+
+    def test_spaces_calls_evenly(self):
+        bucket = TokenBucket(10)
+        bucket.acquire()
+        self.assertEqual(self.fake.sleeps, [])
+        bucket.acquire()
+        bucket.acquire()
+        first, second = self.fake.sleeps
+        # 0.1s and 0.2s plus up to 10% of jitter.
+        self.assertTrue(0.1 <= first <= 0.11)
+        self.assertTrue(0.2 <= second <= 0.22)
+
+    def test_does_not_burst_after_idling(self):
+        bucket = TokenBucket(10)
+        bucket.acquire()
+        self.fake.now += 60
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(len(self.fake.sleeps), 1)
+
+    def test_throttling_halves_the_rate_once_per_second(self):
+        bucket = TokenBucket(16)
+        bucket.on_throttle()
+        bucket.on_throttle()
+        self.assertEqual(bucket.rate, 8)
+        self.fake.now += 1
+        bucket.on_throttle()
+        self.assertEqual(bucket.rate, 4)
+        for _ in range(3):
+            self.fake.now += 1
+            bucket.on_throttle()
+        self.assertEqual(bucket.rate, ratelimit.MIN_RATE)
+
+    def test_success_grows_back_to_the_maximum(self):
+        bucket = TokenBucket(4)
+        bucket.on_throttle()
+        self.assertEqual(bucket.rate, 2)
+        bucket.on_success()
+        self.assertEqual(bucket.rate, 2.5)
+        for _ in range(10):
+            bucket.on_success()
+        self.assertEqual(bucket.rate, 4)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_one_bucket_per_operation(self):
+        limiter = RateLimiter(20, {'ListTasks': 5})
+        self.assertIs(limiter.bucket('ListTasks'),
+                      limiter.bucket('ListTasks'))
+        self.assertEqual(limiter.bucket('ListTasks').rate, 5)
+        self.assertEqual(limiter.bucket('DescribeTasks').rate, 20)
+
+    def test_parse_rates(self):
+        self.assertEqual(parse_rates('DescribeTasks=30, ListTasks=5,'),
+                         {'DescribeTasks': 30, 'ListTasks': 5})
+        self.assertEqual(parse_rates(''), {})
+        for spec in ('ListTasks', 'ListTasks=0', 'ListTasks=x', '=5'):
+            self.assertRaises(ValueError, parse_rates, spec)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import datetime
+import unittest
+
+from ecsctl.selector import (Selector, SelectorError, Template,
+                             parse_custom_columns, parse_field_selector,
+                             parse_path)
+
+
+TASK = {
+    'taskArn': 'arn:aws:ecs:us-east-1:1:task/abc',
+    'lastStatus': 'RUNNING',
+    'createdAt': datetime.datetime(2020, 1, 2, 3, 4, 5),
+    'containers': [
+        {'name': 'web', 'lastStatus': 'RUNNING'},
+        {'name': 'sidecar', 'lastStatus': 'PENDING'},
+    ],
+    'tags': {'aws:cloudformation:stack-name': 'stack'},
+}
+
+
+class ParsePathTest(unittest.TestCase):
+
+    def test_steps(self):
+        self.assertEqual(parse_path('createdAt'), [('key', 'createdAt')])
+        self.assertEqual(parse_path('$.containers[0].name'),
+                         [('key', 'containers'), ('index', 0),
+                          ('key', 'name')])
+        self.assertEqual(parse_path('{.containers[*].name}'),
+                         [('key', 'containers'), ('wildcard', None),
+                          ('key', 'name')])
+        self.assertEqual(parse_path(".tags['aws:cloudformation:stack-name']"),
+                         [('key', 'tags'),
+                          ('key', 'aws:cloudformation:stack-name')])
+
+    def test_invalid(self):
+        for expr in ('.containers[x]', 'a b', '.containers[0]name'):
+            self.assertRaises(SelectorError, parse_path, expr)
+
+
+class SelectorTest(unittest.TestCase):
+
+    def test_first_and_all(self):
+        self.assertEqual(Selector('.containers[-1].name').first(TASK),
+                         'sidecar')
+        self.assertEqual(Selector('.containers[*].lastStatus').all(TASK),
+                         ['RUNNING', 'PENDING'])
+        self.assertIsNone(Selector('.containers[5].name').first(TASK))
+        self.assertEqual(Selector('.missing').all(TASK), [])
+
+    def test_sort_key_puts_missing_last(self):
+        records = [{'n': 2}, {}, {'n': 1}]
+        records.sort(key=Selector('n').sort_key)
+        self.assertEqual(records, [{'n': 1}, {'n': 2}, {}])
+
+    def test_sort_key_of_lists_and_dicts(self):
+        # Lists and dicts are keyed by their JSON, so they compare.
+        records = [{'v': {'b': 1}}, {'v': [2]}, {'v': {'a': 1}}]
+        records.sort(key=Selector('v').sort_key)
+        self.assertEqual(records, [{'v': [2]}, {'v': {'a': 1}},
+                                   {'v': {'b': 1}}])
+
+
+class FieldSelectorTest(unittest.TestCase):
+
+    def test_equal_and_not_equal(self):
+        self.assertTrue(parse_field_selector('lastStatus=RUNNING')(TASK))
+        self.assertTrue(parse_field_selector('lastStatus==RUNNING')(TASK))
+        self.assertFalse(parse_field_selector('lastStatus!=RUNNING')(TASK))
+        self.assertFalse(parse_field_selector(
+            'lastStatus=RUNNING,.containers[0].name=db')(TASK))
+
+    def test_matches_any_selected_value(self):
+        predicate = parse_field_selector('.containers[*].lastStatus=PENDING')
+        self.assertTrue(predicate(TASK))
+        predicate = parse_field_selector('.containers[*].name!=db')
+        self.assertTrue(predicate(TASK))
+
+    def test_missing_value(self):
+        self.assertFalse(parse_field_selector('group=web')(TASK))
+        self.assertTrue(parse_field_selector('group!=web')(TASK))
+
+    def test_invalid(self):
+        self.assertRaises(SelectorError, parse_field_selector, 'lastStatus')
+
+
+class OutputTest(unittest.TestCase):
+
+    def test_custom_columns(self):
+        columns = parse_custom_columns('ID:.taskArn,NAMES:.containers[*].name')
+        self.assertEqual([name for name, _ in columns], ['ID', 'NAMES'])
+        self.assertEqual(columns[1][1].all(TASK), ['web', 'sidecar'])
+        self.assertRaises(SelectorError, parse_custom_columns, 'ID')
+
+    def test_template(self):
+        template = Template(r'{.lastStatus}\t{.containers[*].name}\n')
+        self.assertEqual(template.render(TASK), 'RUNNING\tweb sidecar\n')
+        self.assertEqual(Template('createdAt').render(TASK),
+                         '2020-01-02T03:04:05')
+        self.assertEqual(Template('{.group}').render(TASK), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
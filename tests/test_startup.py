@@ -0,0 +1,58 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+# Modules that make startup slow; commands that do not talk to AWS or
+# docker must not import them.
+HEAVY_MODULES = ['boto3', 'botocore', 'docker', 'dockerpty', 'tabulate']
+
+# Runs ecsctl with the given arguments, then prints the heavy modules
+# that got imported to stderr.
+SCRIPT = '''
+import json, sys
+from ecsctl.__main__ import main
+sys.argv = ['ecsctl'] + sys.argv[1:]
+try:
+    main()
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps([m for m in %r if m in sys.modules]))
+''' % (HEAVY_MODULES,)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StartupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def imported(self, *args):
+        env = dict(os.environ, HOME=self.home, PYTHONPATH=ROOT)
+        env.pop('ECSCTL_TIMINGS', None)
+        proc = subprocess.Popen([sys.executable, '-c', SCRIPT] + list(args),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, env=env)
+        _, err = proc.communicate()
+        return json.loads(err.decode('utf-8').splitlines()[-1])
+
+    def test_help(self):
+        self.assertEqual(self.imported('--help'), [])
+
+    def test_command_help(self):
+        self.assertEqual(self.imported('get', '--help'), [])
+
+    def test_config_show(self):
+        self.assertEqual(self.imported('config', 'show'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()